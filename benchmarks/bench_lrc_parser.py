@@ -0,0 +1,72 @@
+"""Benchmark do parser LRC: LrcParser (streaming, arrays) contra o parser original (regex + dicts + sort).
+
+Uso: python benchmarks/bench_lrc_parser.py [número de linhas]
+"""
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from spotify_lyrics_overlay import LrcParser, parse_lrc
+
+
+def legacy_parse_lrc(lrc_text):
+    """Implementação anterior de LyricsFetcher._parse_lrc, mantida só para comparação."""
+    lyrics = []
+    lrc_regex = re.compile(r'\[(\d{2}):(\d{2})\.(\d{2})\](.*)')
+    for line in lrc_text.splitlines():
+        match = lrc_regex.match(line)
+        if match:
+            minutes, seconds, hundredths, text = match.groups()
+            time_ms = int(minutes) * 60000 + int(seconds) * 1000 + int(hundredths) * 10
+            text = text.strip()
+            if text: lyrics.append({'time': time_ms, 'text': text})
+    lyrics.sort(key=lambda x: x['time'])
+    return lyrics if lyrics else None
+
+
+def make_lrc(line_count, seed=42):
+    """LRC sintético no formato [mm:ss.xx] simples, o único que o parser antigo entende."""
+    rng = random.Random(seed)
+    words = "love night heart fire dance light dream never away tonight baby feel".split()
+    lines = ["[ti:Benchmark]", "[ar:Synthetic]", "[length:99:59]"]
+    time_ms = 0
+    for _ in range(line_count):
+        time_ms += rng.randint(1500, 6000)
+        minutes, rest = divmod(time_ms, 60000)
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(3, 9)))
+        lines.append(f"[{minutes % 100:02d}:{rest // 1000:02d}.{rest % 1000 // 10:02d}]{text}")
+    return "\n".join(lines)
+
+
+def bench(label, func, text, repeat=5):
+    number = max(1, 20000 // max(1, text.count("\n")))
+    best = min(timeit.repeat(lambda: func(text), number=number, repeat=repeat)) / number
+    print(f"  {label:<28} {best * 1000:9.3f} ms/parse")
+    return best
+
+
+def main():
+    line_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    text = make_lrc(line_count)
+    assert [line['text'] for line in legacy_parse_lrc(text)] == parse_lrc(text).texts
+
+    print(f"LRC sintético: {line_count} linhas, {len(text) / 1024:.0f} KiB")
+    legacy = bench("legado (regex + dicts)", legacy_parse_lrc, text)
+    current = bench("LrcParser", parse_lrc, text)
+
+    def chunked(lrc_text, chunk_size=16 * 1024):
+        parser = LrcParser()
+        for start in range(0, len(lrc_text), chunk_size):
+            parser.feed(lrc_text[start:start + chunk_size])
+        return parser.close()
+    bench("LrcParser (blocos de 16 KiB)", chunked, text)
+
+    print(f"  ganho: {legacy / current:.2f}x")
+    return 0 if current < legacy else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
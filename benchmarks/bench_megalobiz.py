@@ -0,0 +1,115 @@
+"""Benchmark do scraping do Megalobiz: parsing em streaming contra árvores BeautifulSoup completas.
+
+Usa as páginas gravadas em benchmarks/fixtures (resultados da pesquisa e página da letra),
+entregues em blocos como numa resposta HTTP em streaming. Mede o tempo por página, o pico
+de memória (tracemalloc) e quantos bytes cada abordagem precisa de ler. O BeautifulSoup só
+é necessário para a comparação com a implementação anterior.
+
+Uso: python benchmarks/bench_megalobiz.py
+"""
+import os
+import sys
+import timeit
+import tracemalloc
+from threading import Event
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from spotify_lyrics_overlay import MegalobizProvider, TrackQuery, parse_lrc
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def legacy_link(html):
+    from bs4 import BeautifulSoup
+    link = BeautifulSoup(html, 'html.parser').find('a', class_='entity_name')
+    return link['href'] if link else None
+
+
+def legacy_lyrics(html):
+    from bs4 import BeautifulSoup
+    span = BeautifulSoup(html, 'html.parser').find('span', {'id': 'lrc_text'})
+    return parse_lrc(span.get_text(separator='\n')) if span else None
+
+
+class FixtureResponse:
+    """Resposta em streaming sobre os bytes de uma fixture; regista quantos bytes foram lidos."""
+    encoding = "utf-8"
+    headers = {}  # sem Content-Length: o resto da página nunca é lido
+
+    def __init__(self, body, log):
+        self.body, self.log = body, log
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            self.log.append(min(chunk_size, len(self.body) - start))
+            yield self.body[start:start + chunk_size]
+
+
+class FixtureSession:
+    def __init__(self, pages):
+        self.pages = pages
+        self.bytes_read = []
+
+    def get(self, url, **kwargs):
+        path = url.split("megalobiz.com", 1)[1]
+        return FixtureResponse(self.pages["search" if path.startswith("/search/") else "lyrics"], self.bytes_read)
+
+
+class NoCache:
+    def lookup(self, key):
+        return False, None
+
+    def put(self, key, value, ttl=None):
+        pass
+
+
+def measure(label, func, repeat=5, number=50):
+    best = min(timeit.repeat(func, number=number, repeat=repeat)) / number
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"  {label:<34} {best * 1000:8.3f} ms   pico {peak / 1024:8.1f} KiB")
+    return best, peak
+
+
+def main():
+    with open(os.path.join(FIXTURES, "megalobiz_search.html"), "rb") as f:
+        search = f.read()
+    with open(os.path.join(FIXTURES, "megalobiz_lyrics.html"), "rb") as f:
+        lyrics = f.read()
+    session = FixtureSession({"search": search, "lyrics": lyrics})
+    provider = MegalobizProvider(session, page_urls=NoCache())
+    query = TrackQuery("Golden Engine", "Silver Morning", 187000)
+    cancel = Event()
+
+    def legacy_fetch():
+        href = legacy_link(search.decode("utf-8"))
+        return legacy_lyrics(lyrics.decode("utf-8")) if href else None
+
+    legacy_result = legacy_fetch()
+    streamed = provider.fetch(query, cancel)
+    assert legacy_result is not None and streamed is not None
+    assert list(legacy_result.times) == list(streamed.times) and legacy_result.texts == streamed.texts
+
+    print(f"Fixtures: pesquisa {len(search) / 1024:.1f} KiB, letra {len(lyrics) / 1024:.1f} KiB")
+    legacy_time, legacy_peak = measure("BeautifulSoup (páginas inteiras)", legacy_fetch)
+    stream_time, stream_peak = measure("HTMLParser em streaming", lambda: provider.fetch(query, cancel))
+    session.bytes_read.clear()
+    provider.fetch(query, cancel)
+    print(f"  bytes lidos: {sum(session.bytes_read)} de {len(search) + len(lyrics)}")
+    print(f"  ganho: {legacy_time / stream_time:.2f}x em tempo, {legacy_peak / stream_peak:.2f}x em memória")
+    return 0 if stream_time < legacy_time else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
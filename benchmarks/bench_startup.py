@@ -0,0 +1,137 @@
+"""Benchmark do arranque a frio: import do módulo, janela visível e token validado.
+
+Cada amostra é um processo novo (como no arranque da sessão) com um spotify_token.json guardado,
+em dois cenários: token ainda válido, aceite sem ir à rede, e token expirado, renovado em segundo
+plano. A API e a renovação do token são servidas pelo servidor local do replay_harness com
+latência artificial, para mostrar que nada no caminho até à janela espera por elas; no cenário
+expirado, "validado" inclui a ida ao servidor. Mede, por processo:
+
+  * import: import de spotify_lyrics_overlay;
+  * janela: desde o início do processo até a janela do overlay estar visível;
+  * validado: até a verificação do token em segundo plano terminar e a monitorização começar;
+  * total: tempo de relógio visto pelo processo pai até à janela (inclui o arranque do Python).
+
+Uso: python benchmarks/bench_startup.py [--runs N] [--latency-ms MS] [--max-window-ms MS] [--json FICHEIRO]
+Com --max-window-ms termina com código 1 se a mediana da janela ultrapassar o limite.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def child(base_url):
+    """Corre num processo novo: arranca o overlay e escreve os tempos numa linha JSON."""
+    start = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    import spotify_lyrics_overlay as overlay_module
+    marks = {"import": time.perf_counter() - start}
+
+    from PySide6.QtWidgets import QApplication
+    overlay_module.SpotifyAPI.BASE_URL = f"{base_url}/v1"
+    overlay_module.SpotifyAPI.TOKEN_URL = f"{base_url}/api/token"
+    app = QApplication(sys.argv)
+    overlay = overlay_module.SpotifyLyricsOverlay(app)
+    overlay.poll_playback = lambda: None  # só interessa o arranque, não as consultas
+    start_monitoring = overlay.start_monitoring
+
+    def on_monitoring():
+        marks["validated"] = time.perf_counter() - start
+        start_monitoring()
+
+    overlay.start_monitoring = on_monitoring
+    overlay.run()
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline and ("window" not in marks or "validated" not in marks):
+        app.processEvents()
+        if "window" not in marks and overlay.ui.isVisible():
+            marks["window"] = time.perf_counter() - start
+            print("WINDOW", flush=True)
+        time.sleep(0.001)
+    overlay.shutdown()
+    overlay.ui.close()
+    print(json.dumps({name: value * 1000 for name, value in marks.items()}), flush=True)
+    del overlay
+    return 0
+
+
+def run_sample(base_url, workdir, expires_in):
+    # O token é gravado de novo em cada amostra: a renovação do cenário expirado substitui-o.
+    with open(os.path.join(workdir, "spotify_token.json"), "w", encoding="utf-8") as f:
+        json.dump({"access_token": "benchmark", "refresh_token": "benchmark", "expires_at": time.time() + expires_in}, f)
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen", PYSTRAY_BACKEND="dummy", LYRICS_OVERLAY_DAEMON="off",
+               SPOTIPY_CLIENT_ID=os.environ.get("SPOTIPY_CLIENT_ID", "benchmark"),
+               SPOTIPY_CLIENT_SECRET=os.environ.get("SPOTIPY_CLIENT_SECRET", "benchmark"))
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--child", base_url], cwd=workdir, env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    total_ms = None
+    result = {}
+    for line in process.stdout:
+        if line.startswith("WINDOW"):
+            total_ms = (time.perf_counter() - started) * 1000
+        elif line.startswith("{"):
+            result = json.loads(line)
+    process.wait()
+    result["total"] = total_ms
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="processos medidos")
+    parser.add_argument("--latency-ms", type=float, default=300, help="latência artificial das respostas do servidor local")
+    parser.add_argument("--max-window-ms", type=float, help="falha se a mediana até à janela ultrapassar este valor")
+    parser.add_argument("--json", help="grava também o relatório em JSON neste ficheiro")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args.child)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from replay_harness import StandInServer
+
+    server = StandInServer(args.latency_ms)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    workdir = tempfile.mkdtemp(prefix="overlay-startup-")
+
+    reports = {}
+    for scenario, label, expires_in in (("fresh_token", "token válido", 3600), ("expired_token", "token expirado", -60)):
+        samples = [run_sample(server.base_url, workdir, expires_in) for _ in range(args.runs)]
+        report = reports[scenario] = {}
+        for name in ("import", "window", "validated", "total"):
+            values = [sample[name] for sample in samples if sample.get(name) is not None]
+            if values:
+                report[name] = {"median_ms": statistics.median(values), "min_ms": min(values), "max_ms": max(values), "n": len(values)}
+
+        print(f"== Arranque a frio, {label} ({args.runs} processos, servidor local com {args.latency_ms:.0f} ms) ==")
+        for name, stats in report.items():
+            print(f"{name:<10} mediana {stats['median_ms']:8.1f} ms   (mín {stats['min_ms']:.1f}, máx {stats['max_ms']:.1f})")
+    refreshes = server.counters["spotify:token"]
+    server.shutdown()
+    print(f"renovações do token: {refreshes}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+
+    status = 0
+    for scenario, report in reports.items():
+        window = report.get("window")
+        if window is None:
+            print(f"A janela nunca ficou visível ({scenario}).")
+            status = 1
+        elif args.max_window_ms is not None and window["median_ms"] > args.max_window_ms:
+            print(f"Regressão ({scenario}): mediana até à janela {window['median_ms']:.1f} ms > {args.max_window_ms:.1f} ms")
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
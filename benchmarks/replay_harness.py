@@ -0,0 +1,343 @@
+"""Harness de replay e benchmark do pipeline poll -> render, sem ecrã e sem rede.
+
+Um servidor HTTP local faz de Spotify, LRCLIB, Megalobiz e CDN das capas, servindo os
+payloads `currently-playing` gravados e as páginas em benchmarks/fixtures. O harness conduz
+SpotifyAPI, LyricsFetcher, SpotifyLyricsOverlay.process_playback_data e
+LyricsUI.update_display na plataforma Qt `offscreen` e mede:
+
+  * latência das consultas ao Spotify e das pesquisas de letras (a frio e com cache);
+  * tempo até à primeira letra após uma mudança de faixa;
+  * CPU e alocações por tick de atualização;
+  * pedidos HTTP e ligações TCP abertas por rota.
+
+Uso: python benchmarks/replay_harness.py [--ticks N] [--latency-ms MS] [--json FICHEIRO]
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+os.environ.setdefault("PYSTRAY_BACKEND", "dummy")
+os.environ.setdefault("LYRICS_OVERLAY_DAEMON", "off")  # mede sempre a resolução no próprio processo
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, "benchmarks", "fixtures")
+sys.path.insert(0, ROOT)
+
+from PIL import Image
+from PySide6.QtWidgets import QApplication
+
+from spotify_lyrics_overlay import (HttpSession, LrclibProvider, LyricsFetcher, MegalobizProvider,
+                                    PersistentLRUCache, SpotifyAPI, SpotifyLyricsOverlay)
+
+
+# --- Servidor local que substitui os serviços remotos ---
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, para medir a reutilização de ligações
+    disable_nagle_algorithm = True  # sem isto, cabeçalhos e corpo em escritas separadas custam ~40 ms de ACK atrasado
+
+    def setup(self):
+        super().setup()
+        self.server.count("tcp_connections")
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        server = self.server
+        if server.latency_s:
+            time.sleep(server.latency_s)
+
+        if url.path == "/v1/me":
+            server.count("spotify:/me")
+            return self._send_json({"id": "benchmark"})
+        if url.path == "/v1/me/player/currently-playing":
+            server.count("spotify:currently-playing")
+            return self._send_json(server.current_playback())
+        if url.path == "/v1/me/player/queue":
+            server.count("spotify:queue")
+            return self._send_json({"queue": server.upcoming_tracks()})
+        if url.path == "/lrclib/api/get":
+            server.count("lrclib:get")
+            key = f"{query.get('track_name', [''])[0]}|{query.get('artist_name', [''])[0]}"
+            album, duration = query.get("album_name", [""])[0], float(query.get("duration", ["0"])[0])
+            for entry in server.lrclib.get(key, []):
+                if entry.get("albumName") == album and abs(entry.get("duration", 0) - duration) <= 2:
+                    return self._send_json(entry)
+            return self._send(404, "application/json", b'{"code":404,"name":"TrackNotFound"}')
+        if url.path == "/lrclib/api/search":
+            server.count("lrclib:search")
+            key = f"{query.get('track_name', [''])[0]}|{query.get('artist_name', [''])[0]}"
+            return self._send_json(server.lrclib.get(key, []))
+        if url.path == "/megalobiz/search/all":
+            server.count("megalobiz:search")
+            found = "golden engine" in query.get("qry", [""])[0].lower()
+            return self._send(200, "text/html; charset=utf-8", server.megalobiz_search if found else server.megalobiz_empty)
+        if url.path.startswith("/megalobiz/lrc/"):
+            server.count("megalobiz:lyrics")
+            return self._send(200, "text/html; charset=utf-8", server.megalobiz_lyrics)
+        if url.path.startswith("/art/"):
+            server.count("art")
+            return self._send(200, "image/jpeg", server.album_art(url.path))
+        server.count("404")
+        return self._send(404, "text/plain", b"not found")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.server.latency_s:
+            time.sleep(self.server.latency_s)
+        if url.path == "/api/token":
+            self.server.count("spotify:token")
+            return self._send_json({"access_token": "benchmark-refreshed", "token_type": "Bearer", "expires_in": 3600})
+        self.server.count("404")
+        return self._send(404, "text/plain", b"not found")
+
+    def _send_json(self, payload):
+        self._send(200, "application/json", json.dumps(payload).encode())
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency_ms=0):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.base_url = f"http://127.0.0.1:{self.server_address[1]}"
+        self.latency_s = latency_ms / 1000
+        self.counters = Counter()
+        self._lock = threading.Lock()
+        self._art_cache = {}
+
+        with open(os.path.join(FIXTURES, "playback.json"), encoding="utf-8") as f:
+            self.sequence = [self._absolute_urls(payload) for payload in json.load(f)["sequence"]]
+        with open(os.path.join(FIXTURES, "lrclib_search.json"), encoding="utf-8") as f:
+            self.lrclib = json.load(f)
+        with open(os.path.join(FIXTURES, "megalobiz_search.html"), "rb") as f:
+            self.megalobiz_search = f.read()
+        with open(os.path.join(FIXTURES, "megalobiz_lyrics.html"), "rb") as f:
+            self.megalobiz_lyrics = f.read()
+        self.megalobiz_empty = b"<html><body><div id='content'><p>No results.</p></div></body></html>"
+        self.position = 0
+
+    def _absolute_urls(self, payload):
+        for image in payload["item"]["album"]["images"]:
+            image["url"] = self.base_url + image["url"]
+        return payload
+
+    def count(self, route):
+        with self._lock:
+            self.counters[route] += 1
+
+    def current_playback(self):
+        return self.sequence[self.position]
+
+    def upcoming_tracks(self):
+        current_id = self.current_playback()["item"]["id"]
+        seen, queue = {current_id}, []
+        for payload in self.sequence[self.position:] + self.sequence[:self.position]:
+            if payload["item"]["id"] not in seen:
+                seen.add(payload["item"]["id"])
+                queue.append(payload["item"])
+        return queue
+
+    def tracks(self):
+        """Índice do primeiro payload de cada faixa na sequência gravada."""
+        first = {}
+        for index, payload in enumerate(self.sequence):
+            first.setdefault(payload["item"]["id"], index)
+        return list(first.values())
+
+    def album_art(self, path):
+        with self._lock:
+            body = self._art_cache.get(path)
+            if body is None:
+                seed = sum(path.encode())
+                size = 640 if "640" in path else 64
+                img = Image.new("RGB", (size, size), (seed * 37 % 256, seed * 91 % 256, seed * 53 % 256))
+                buffer = io.BytesIO()
+                img.save(buffer, "JPEG", quality=85)
+                body = self._art_cache[path] = buffer.getvalue()
+            return body
+
+
+# --- Medições ---
+
+def summarize(samples_s):
+    samples_ms = sorted(sample * 1000 for sample in samples_s)
+    p95 = samples_ms[min(len(samples_ms) - 1, int(len(samples_ms) * 0.95))]
+    return {"n": len(samples_ms), "mean_ms": statistics.fmean(samples_ms), "p95_ms": p95, "max_ms": samples_ms[-1]}
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def spin_until(app, predicate, timeout_s=30):
+    deadline = time.monotonic() + timeout_s
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise TimeoutError("o pipeline não produziu letras a tempo")
+        app.processEvents()
+        time.sleep(0.001)
+
+
+def bench_spotify_poll(server, session, polls):
+    api = SpotifyAPI(session=session)
+    api.access_token, api.token_expires_at = "benchmark", time.time() + 3600
+    before = server.counters["tcp_connections"]
+    samples = [timed(api.get_current_playback)[0] for _ in range(polls)]
+    report = summarize(samples)
+    report["tcp_connections"] = server.counters["tcp_connections"] - before
+    return report
+
+
+def bench_lyrics_lookup(server, session, workdir):
+    fetcher = LyricsFetcher(cache=PersistentLRUCache(os.path.join(workdir, "bench_lyrics.sqlite3")), session=session)
+    cold, warm = [], []
+    for index in server.tracks():
+        track = server.sequence[index]["item"]
+        args = (track["name"], track["artists"][0]["name"], track["duration_ms"], None, track["album"]["name"])
+        cold.append(timed(fetcher.get_synced_lyrics, *args)[0])
+        warm.append(timed(fetcher.get_synced_lyrics, *args)[0])
+    return {"cold": summarize(cold), "warm": summarize(warm)}
+
+
+def bench_time_to_first_lyric(app, server, overlay):
+    samples = []
+    for index in server.tracks():
+        server.position = index
+        start = time.perf_counter()
+        overlay.poll_timer.stop()
+        overlay.poll_playback()
+        track_id = server.sequence[index]["item"]["id"]
+        spin_until(app, lambda: overlay.current_track_id == track_id and overlay.synced_lyrics is not None)
+        samples.append(time.perf_counter() - start)
+    overlay.tasks.new_generation()
+    return summarize(samples)
+
+
+def bench_ticks(overlay, server, ticks):
+    """CPU e alocações por tick: process_playback_data completo e a atualização leve da linha ativa."""
+    index = server.tracks()[0]
+    payload = server.sequence[index]
+    track = payload["item"]
+    overlay.synced_lyrics = overlay.lyrics_fetcher.get_synced_lyrics(track["name"], track["artists"][0]["name"], track["duration_ms"])
+    overlay.current_track_id = track["id"]
+    step_ms = max(1, track["duration_ms"] // ticks)
+
+    def run(func):
+        tracemalloc.start()
+        snapshot_before = tracemalloc.take_snapshot()
+        cpu_start = time.process_time()
+        for tick in range(ticks):
+            overlay.clock.update(track["id"], tick * step_ms, track["duration_ms"], True)
+            func()
+        cpu_s = time.process_time() - cpu_start
+        snapshot_after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        allocated = sum(stat.size_diff for stat in snapshot_after.compare_to(snapshot_before, "filename") if stat.size_diff > 0)
+        return {"ticks": ticks, "cpu_us_per_tick": cpu_s / ticks * 1e6, "retained_bytes": allocated, "peak_bytes": peak}
+
+    return {
+        "process_playback_data": run(lambda: overlay.process_playback_data(payload)),
+        "refresh_lyrics_line": run(overlay.refresh_lyrics_line),
+    }
+
+
+def bench_update_display(overlay, ticks):
+    ui = overlay.ui
+    lines = overlay.synced_lyrics.texts if overlay.synced_lyrics else ["a", "b"]
+    cpu_start = time.process_time()
+    for tick in range(ticks):
+        current = lines[(tick // 10) % len(lines)]  # cada linha fica ~10 ticks, como na reprodução real
+        ui.update_display(current, lines[(tick // 10 + 1) % len(lines)], tick * 100, 200000, True)
+    return {"ticks": ticks, "cpu_us_per_tick": (time.process_time() - cpu_start) / ticks * 1e6}
+
+
+def print_report(report):
+    print("\n== Benchmark poll -> render ==")
+    poll = report["spotify_poll"]
+    print(f"Spotify currently-playing: média {poll['mean_ms']:.2f} ms, p95 {poll['p95_ms']:.2f} ms "
+          f"({poll['n']} consultas, {poll['tcp_connections']} ligações TCP)")
+    lookup = report["lyrics_lookup"]
+    print(f"Pesquisa de letras: a frio {lookup['cold']['mean_ms']:.2f} ms (máx {lookup['cold']['max_ms']:.2f}), "
+          f"com cache {lookup['warm']['mean_ms']:.3f} ms")
+    print(f"Tempo até à primeira letra: a frio {report['ttfl_cold']['mean_ms']:.2f} ms, "
+          f"com cache {report['ttfl_warm']['mean_ms']:.2f} ms")
+    for name, tick in report["ticks"].items():
+        print(f"Tick {name}: {tick['cpu_us_per_tick']:.1f} µs CPU, {tick['retained_bytes']} B retidos, pico {tick['peak_bytes']} B")
+    print(f"LyricsUI.update_display: {report['update_display']['cpu_us_per_tick']:.1f} µs CPU por chamada")
+    print("Pedidos HTTP por rota:")
+    for route, count in sorted(report["http_requests"].items()):
+        print(f"  {route:<28} {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ticks", type=int, default=2000, help="ticks simulados nas medições de CPU")
+    parser.add_argument("--polls", type=int, default=100, help="consultas ao Spotify na medição de latência")
+    parser.add_argument("--latency-ms", type=float, default=0, help="latência artificial por pedido no servidor local")
+    parser.add_argument("--json", help="grava também o relatório em JSON neste ficheiro")
+    args = parser.parse_args()
+
+    server = StandInServer(args.latency_ms)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    SpotifyAPI.BASE_URL = f"{server.base_url}/v1"
+    LrclibProvider.BASE_URL = f"{server.base_url}/lrclib"
+    MegalobizProvider.BASE_URL = f"{server.base_url}/megalobiz"
+
+    workdir = tempfile.mkdtemp(prefix="overlay-bench-")
+    os.chdir(workdir)  # caches em disco do overlay ficam isoladas
+    app = QApplication.instance() or QApplication(sys.argv)
+    session = HttpSession()
+
+    report = {
+        "spotify_poll": bench_spotify_poll(server, session, args.polls),
+        "lyrics_lookup": bench_lyrics_lookup(server, session, workdir),
+    }
+
+    overlay = SpotifyLyricsOverlay(app)
+    overlay.spotify.access_token, overlay.spotify.token_expires_at = "benchmark", time.time() + 3600
+    overlay.ui.show()
+    report["ttfl_cold"] = bench_time_to_first_lyric(app, server, overlay)
+    report["ttfl_warm"] = bench_time_to_first_lyric(app, server, overlay)
+    report["ticks"] = bench_ticks(overlay, server, args.ticks)
+    report["update_display"] = bench_update_display(overlay, args.ticks)
+    report["http_requests"] = dict(server.counters)
+    overlay.shutdown()
+    server.shutdown()
+    overlay.ui.close()
+    del overlay  # os QObjects do overlay têm de morrer antes da QApplication
+
+    print_report(report)
+    if args.json:
+        with open(os.path.join(ROOT, args.json) if not os.path.isabs(args.json) else args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,31 +1,306 @@
 import sys
+import os
+import stat
+import argparse
+import logging
 import requests
 import json
 import time
 import threading
+import socket
+import socketserver
+import itertools
+import sqlite3
+from collections import namedtuple, Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeoutError
+from array import array
+from bisect import bisect_right
+import heapq
+import math
+from itertools import compress, islice
+from operator import add, le
 import webbrowser
 from urllib.parse import quote
 import re
+import mmap
+import struct
+import zlib
+import unicodedata
+from difflib import SequenceMatcher
+from functools import lru_cache
 import base64
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import codecs
+from html.parser import HTMLParser
+import tempfile
 import urllib.parse
-from bs4 import BeautifulSoup
-from PIL import Image, ImageDraw
-import pystray
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+# PIL, pystray, numpy e http.server só são importados quando são precisos, para o overlay arrancar depressa.
+
+@lru_cache(maxsize=None)
+def _optional_numpy():
+    """NumPy (opcional: acelera a extração da paleta da capa), ou None se não estiver instalado."""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
 
 # Importa a nova biblioteca para a interface e efeitos
-from PySide6.QtWidgets import QApplication, QWidget, QLabel, QVBoxLayout, QHBoxLayout, QFrame, QGraphicsDropShadowEffect, QProgressBar, QStackedWidget
-from PySide6.QtGui import QColor, QFont
-from PySide6.QtCore import Qt, Signal, QObject, QPropertyAnimation, QEasingCurve, QRect, Property
+from PySide6.QtWidgets import QApplication, QWidget, QLabel, QVBoxLayout, QHBoxLayout, QFrame, QProgressBar, QStackedWidget
+from PySide6.QtGui import QColor, QFont, QFontMetrics, QPainter, QPixmap
+from PySide6.QtCore import Qt, Signal, QObject, QPropertyAnimation, QVariantAnimation, QEasingCurve, QRect, QPointF, QSize, Property, QTimer
+
+# --- Instrumentação ---
+
+class _NullTimer:
+    __slots__ = ()
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+
+_NULL_TIMER = _NullTimer()
+
+class _Timer:
+    __slots__ = ('_metrics', '_name', '_labels', '_start')
+
+    def __init__(self, metrics, name, labels):
+        self._metrics, self._name, self._labels = metrics, name, labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._metrics.observe(self._name, time.perf_counter() - self._start, **self._labels)
+        return False
+
+class Metrics:
+    """Contadores, gauges e histogramas dos caminhos críticos, expostos em formato Prometheus.
+
+    Desativadas por omissão: cada chamada fica reduzida a um teste de booleano. Ativam-se com
+    LYRICS_OVERLAY_METRICS=1 (logs estruturados em JSON no stderr) e, opcionalmente,
+    LYRICS_OVERLAY_METRICS_PORT=<porta> para servir /metrics em 127.0.0.1.
+    """
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._logger = logging.getLogger("spotify_lyrics_overlay")
+
+    @classmethod
+    def from_env(cls):
+        return cls(enabled=os.environ.get("LYRICS_OVERLAY_METRICS", "") not in ("", "0"))
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled: return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        if not self.enabled: return
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        """Regista uma amostra (em segundos, por convenção) num histograma."""
+        if not self.enabled: return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * len(self.BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def timer(self, name, **labels):
+        """Context manager que mede a duração do bloco; sem custo quando as métricas estão desativadas."""
+        if not self.enabled: return _NULL_TIMER
+        return _Timer(self, name, labels)
+
+    def log_event(self, event, **fields):
+        if not self.enabled: return
+        fields['event'] = event
+        fields['ts'] = round(time.time(), 3)
+        self._logger.info(json.dumps(fields, ensure_ascii=False, default=str))
+
+    def render_prometheus(self):
+        def fmt_labels(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items: return ""
+            return "{" + ",".join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in items) + "}"
+
+        lines, typed = [], set()
+        with self._lock:
+            for kind, series in (("counter", self._counters), ("gauge", self._gauges)):
+                for (name, labels), value in sorted(series.items()):
+                    if name not in typed:
+                        typed.add(name)
+                        lines.append(f"# TYPE {name} {kind}")
+                    lines.append(f"{name}{fmt_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {name} histogram")
+                for bound, count in zip(self.BUCKETS, histogram):
+                    lines.append(f"{name}_bucket{fmt_labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{fmt_labels(labels, [('le', '+Inf')])} {histogram[-1]}")
+                lines.append(f"{name}_sum{fmt_labels(labels)} {histogram[-2]}")
+                lines.append(f"{name}_count{fmt_labels(labels)} {histogram[-1]}")
+        return "\n".join(lines) + "\n"
+
+class MetricsServer:
+    """Endpoint HTTP local (só 127.0.0.1) que serve as métricas em formato de texto Prometheus."""
+
+    def __init__(self, metrics, port):
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+        metrics_ref = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics_ref.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = HTTPServer(("127.0.0.1", port), Handler)
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+METRICS = Metrics.from_env()
+
+# --- Camada HTTP partilhada ---
+
+class RequestCancelled(requests.RequestException):
+    """O pedido foi abandonado antes de ser enviado (cancel_event ativo durante a espera pelo limite do host)."""
+
+class HttpSession(requests.Session):
+    """Sessão partilhada: pools de ligações keep-alive por host, timeout por omissão e retries com backoff."""
+    # (ligação, leitura) em segundos. Também limita a saída: o interpretador espera pelos pedidos ainda em voo.
+    DEFAULT_TIMEOUT = (3.05, 5)
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, retries=2, backoff_factor=0.5, pool_connections=10, pool_maxsize=10):
+        super().__init__()
+        self.timeout = timeout
+        retry = Retry(
+            # Um timeout de leitura não se repete: só prolongaria o bloqueio (e a saída, que espera por ele).
+            total=retries, connect=retries, read=0, status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(500, 502, 503, 504),  # 429 é tratado por quem chama, sem bloquear aqui
+            # Com True, o urllib3 repetiria também os 429 com Retry-After (dormindo dentro do pedido).
+            respect_retry_after_header=False,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        self._pool_maxsize = pool_maxsize
+        self._rate_lock = threading.Lock()
+        self._min_interval = {}  # host -> segundos entre pedidos
+        self._next_slot = {}
+
+    def disable_retries(self, prefix):
+        """Pedidos para URLs começados por prefix não são repetidos (nem ligação, nem leitura, nem 5xx):
+        para consultas periódicas, em que a próxima consulta já é a repetição."""
+        self.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=self._pool_maxsize,
+                                       max_retries=Retry(total=0, raise_on_status=False)))
+
+    def set_rate_limit(self, host, requests_per_second):
+        """Limita os pedidos a um host (partilhado por todas as threads); None remove o limite."""
+        with self._rate_lock:
+            if requests_per_second:
+                self._min_interval[host] = 1.0 / requests_per_second
+            else:
+                self._min_interval.pop(host, None)
+
+    def _wait_for_slot(self, url, cancel_event=None):
+        """Espera pela vez do host. A vez só é reservada quando chega, por isso um pedido
+        cancelado a meio da espera não deixa buracos nem atrasa os que vêm a seguir."""
+        host = urllib.parse.urlsplit(url).hostname
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                raise RequestCancelled(url)
+            with self._rate_lock:
+                interval = self._min_interval.get(host)
+                if interval is None: return
+                now = time.monotonic()
+                slot = self._next_slot.get(host, now)
+                if slot <= now:
+                    self._next_slot[host] = now + interval
+                    return
+            if cancel_event is None:
+                time.sleep(slot - now)
+            else:
+                cancel_event.wait(slot - now)
+
+    def request(self, method, url, cancel_event=None, **kwargs):
+        """Como requests.Session.request; com cancel_event, desiste (RequestCancelled) se for ativado antes do envio."""
+        kwargs.setdefault('timeout', self.timeout)
+        if self._min_interval:
+            self._wait_for_slot(url, cancel_event)
+        elif cancel_event is not None and cancel_event.is_set():
+            raise RequestCancelled(url)
+        return super().request(method, url, **kwargs)
+
+def _atomic_write_json(path, data):
+    """Grava data em path de forma atómica (ficheiro temporário + os.replace): nunca fica um ficheiro a meio.
+    Propaga OSError, sem deixar o temporário para trás."""
+    directory = os.path.dirname(os.path.abspath(path))
+    prefix = '.' + os.path.splitext(os.path.basename(path))[0] + '.'
+    fd, temp_path = tempfile.mkstemp(prefix=prefix, suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except OSError:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
 
-# --- Classes de Lógica de Negócio (sem alterações) ---
+# --- Classes de Lógica de Negócio ---
 
 class SpotifyAPI:
-    """Gerencia toda a comunicação com a API do Spotify."""
-    BASE_URL = "https://api.spotify.com/v1"
+    """Gerencia toda a comunicação com a API do Spotify.
 
-    def __init__(self):
-        import os
+    O token de acesso é renovado em segundo plano REFRESH_MARGIN segundos antes de expirar, por
+    isso as consultas não pagam a autenticação. Só corre uma renovação de cada vez: quem precisar
+    dela entretanto espera pelo mesmo resultado. Um 401 força a renovação e repete o pedido uma vez.
+    """
+    BASE_URL = "https://api.spotify.com/v1"
+    TOKEN_URL = "https://accounts.spotify.com/api/token"
+    TOKEN_PATH = 'spotify_token.json'
+    POLL_TIMEOUT = (3.05, 5)
+    REFRESH_MARGIN = 300      # segundos antes de expirar
+    REFRESH_RETRY_DELAY = 30  # após uma renovação em segundo plano falhada
+
+    def __init__(self, session=None):
+        self.http = session if session is not None else HttpSession()
+        # A consulta periódica não se repete: a próxima consulta, segundos depois, já é a repetição.
+        self.http.disable_retries(f"{self.BASE_URL}/me/player/currently-playing")
         self.client_id = os.environ.get("SPOTIPY_CLIENT_ID")
         self.client_secret = os.environ.get("SPOTIPY_CLIENT_SECRET")
 
@@ -40,44 +315,45 @@ class SpotifyAPI:
         self.access_token = None
         self.refresh_token = None
         self.token_expires_at = 0
-
-    def load_saved_token(self):
+        self.rate_limited_until = 0
+        self.last_poll_rtt = None  # s, do envio do pedido aos cabeçalhos da resposta (sem renovações de token)
+        self._refresh_lock = threading.Lock()
+        self._refresh_timer = None
+        self._closed = False
+
+    def read_saved_token(self):
+        """Só lê spotify_token.json (sem rede): True se houver um token guardado."""
         try:
-            with open('spotify_token.json', 'r', encoding='utf-8') as f:
+            with open(self.TOKEN_PATH, 'r', encoding='utf-8') as f:
                 token_data = json.load(f)
-                self.access_token = token_data.get('access_token')
-                self.refresh_token = token_data.get('refresh_token')
-                self.token_expires_at = token_data.get('expires_at', 0)
-
-            if time.time() >= self.token_expires_at:
-                if not self.refresh_access_token():
-                    return False
-                return True
-
-            if not self._is_token_valid():
-                return False
-
-            return True
         except (FileNotFoundError, json.JSONDecodeError):
             return False
-
-    def _is_token_valid(self):
-        if not self.access_token: return False
-        headers = {"Authorization": f"Bearer {self.access_token}"}
-        response = requests.get(f"{self.BASE_URL}/me", headers=headers)
-        return response.status_code == 200
+        self.access_token = token_data.get('access_token')
+        self.refresh_token = token_data.get('refresh_token')
+        self.token_expires_at = token_data.get('expires_at', 0)
+        self._schedule_refresh()
+        return bool(self.access_token or self.refresh_token)
+
+    def validate_token(self):
+        """Um token ainda fresco é aceite sem ir à rede (um 401 posterior é tratado nos pedidos); senão, renova-o."""
+        if self.access_token and time.time() < self.token_expires_at - self.REFRESH_MARGIN:
+            return True
+        return self.refresh_access_token(stale_token=self.access_token)
 
     def save_token(self):
+        """Grava de forma atómica: nunca fica um spotify_token.json a meio."""
         token_data = {
             'access_token': self.access_token,
             'refresh_token': self.refresh_token,
             'expires_at': self.token_expires_at
         }
-        with open('spotify_token.json', 'w', encoding='utf-8') as f:
-            json.dump(token_data, f)
+        try:
+            _atomic_write_json(self.TOKEN_PATH, token_data)
+        except OSError as e:
+            print(f"Aviso: não foi possível gravar o token: {e}")
 
     def get_auth_url(self):
-        scopes = "user-read-currently-playing user-read-playback-state"
+        scopes = "user-read-currently-playing user-read-playback-state playlist-read-private user-library-read"
         params = {
             "client_id": self.client_id, "response_type": "code",
             "redirect_uri": self.redirect_uri, "scope": scopes
@@ -85,112 +361,1992 @@ class SpotifyAPI:
         return f"https://accounts.spotify.com/authorize?{urllib.parse.urlencode(params)}"
 
     def exchange_code_for_token(self, auth_code):
-        token_url = "https://accounts.spotify.com/api/token"
         auth_header = base64.b64encode(f"{self.client_id}:{self.client_secret}".encode()).decode()
         headers = {"Authorization": f"Basic {auth_header}", "Content-Type": "application/x-www-form-urlencoded"}
         data = {"grant_type": "authorization_code", "code": auth_code, "redirect_uri": self.redirect_uri}
         try:
-            response = requests.post(token_url, headers=headers, data=data)
+            response = self.http.post(self.TOKEN_URL, headers=headers, data=data)
             response.raise_for_status()
             token_data = response.json()
             self.access_token = token_data["access_token"]
             self.refresh_token = token_data.get("refresh_token")
             self.token_expires_at = time.time() + token_data["expires_in"]
             self.save_token()
+            self._schedule_refresh()
             return True
         except requests.RequestException:
             return False
 
-    def refresh_access_token(self):
+    def authenticate_console(self):
+        """Autorização OAuth pela consola: abre o browser e pede o URL de redirecionamento."""
+        auth_url = self.get_auth_url()
+        print(f"\n1. Copie esta URL: {auth_url}\n2. Cole no navegador, autorize e cole o URL de redirecionamento aqui.")
+        webbrowser.open(auth_url)
+        while True:
+            try:
+                redirected_url = input("🔗 Cole o URL de redirecionamento aqui: ")
+                parsed_url = urllib.parse.urlparse(redirected_url)
+                query_params = urllib.parse.parse_qs(parsed_url.query)
+                if 'code' in query_params:
+                    if self.exchange_code_for_token(query_params['code'][0]):
+                        return True
+                else:
+                    print("❌ URL inválido.")
+            except Exception:
+                print("❌ Erro na autenticação. A encerrar.")
+                return False
+
+    def refresh_access_token(self, stale_token=None):
+        """Renova o token (single-flight). Com stale_token, não repete se outra thread já o substituiu entretanto."""
         if not self.refresh_token: return False
-        token_url = "https://accounts.spotify.com/api/token"
-        auth_header = base64.b64encode(f"{self.client_id}:{self.client_secret}".encode()).decode()
-        headers = {"Authorization": f"Basic {auth_header}"}
-        data = {"grant_type": "refresh_token", "refresh_token": self.refresh_token}
-        try:
-            response = requests.post(token_url, headers=headers, data=data)
-            response.raise_for_status()
-            token_data = response.json()
-            self.access_token = token_data["access_token"]
-            self.refresh_token = token_data.get("refresh_token", self.refresh_token)
-            self.token_expires_at = time.time() + token_data["expires_in"]
+        with self._refresh_lock:
+            if stale_token is not None and self.access_token != stale_token and time.time() < self.token_expires_at:
+                return True
+            auth_header = base64.b64encode(f"{self.client_id}:{self.client_secret}".encode()).decode()
+            headers = {"Authorization": f"Basic {auth_header}"}
+            data = {"grant_type": "refresh_token", "refresh_token": self.refresh_token}
+            try:
+                response = self.http.post(self.TOKEN_URL, headers=headers, data=data)
+                response.raise_for_status()
+                token_data = response.json()
+                self.access_token = token_data["access_token"]
+                self.refresh_token = token_data.get("refresh_token", self.refresh_token)
+                self.token_expires_at = time.time() + token_data["expires_in"]
+            except (requests.RequestException, ValueError, KeyError):
+                return False
             self.save_token()
-            return True
-        except requests.RequestException:
-            return False
+        self._schedule_refresh()
+        return True
+
+    def _schedule_refresh(self, delay=None):
+        """Arma a renovação em segundo plano para REFRESH_MARGIN segundos antes da expiração."""
+        if self._closed or not self.refresh_token: return
+        if delay is None:
+            delay = max(0.0, self.token_expires_at - self.REFRESH_MARGIN - time.time())
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+        self._refresh_timer = threading.Timer(delay, self._background_refresh, args=(self.access_token,))
+        self._refresh_timer.daemon = True
+        self._refresh_timer.start()
+
+    def _background_refresh(self, stale_token):
+        if not self.refresh_access_token(stale_token=stale_token):
+            self._schedule_refresh(self.REFRESH_RETRY_DELAY)
+
+    def close(self):
+        self._closed = True
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+
+    def _authorized_get(self, url, **kwargs):
+        """GET com o token atual, ou None sem credenciais. Um 401 (token revogado ou expirado antes
+        do previsto) força uma renovação e repete o pedido uma vez."""
+        token = self.access_token
+        if not token or time.time() >= self.token_expires_at:
+            # Só acontece se a renovação em segundo plano falhou: renova aqui, partilhando a que estiver em curso.
+            if not self.refresh_access_token(stale_token=token): return None
+            token = self.access_token
+        response = self.http.get(url, headers={"Authorization": f"Bearer {token}"}, **kwargs)
+        if response.status_code == 401 and self.refresh_access_token(stale_token=token):
+            response.close()
+            response = self.http.get(url, headers={"Authorization": f"Bearer {self.access_token}"}, **kwargs)
+        return response
+
+    def retry_after(self):
+        """Segundos que ainda faltam para o Spotify voltar a aceitar pedidos após um 429."""
+        return max(0.0, self.rate_limited_until - time.monotonic())
+
+    def _note_rate_limit(self, response):
+        try:
+            delay = float(response.headers.get('Retry-After', 5))
+        except ValueError:
+            delay = 5.0
+        self.rate_limited_until = time.monotonic() + delay
 
     def get_current_playback(self):
-        if time.time() >= self.token_expires_at:
-            if not self.refresh_access_token(): return None
-        headers = {"Authorization": f"Bearer {self.access_token}"}
+        if self.retry_after() > 0: return None
         try:
-            response = requests.get(f"{self.BASE_URL}/me/player/currently-playing?market=from_token", headers=headers)
+            started = time.perf_counter()
+            response = self._authorized_get(f"{self.BASE_URL}/me/player/currently-playing?market=from_token", timeout=self.POLL_TIMEOUT)
+            if response is None: return None
+            METRICS.observe("spotify_poll_rtt_seconds", time.perf_counter() - started, status=response.status_code)
+            if response.status_code == 429:
+                self._note_rate_limit(response)
+                return None
             if response.status_code == 200 and response.text:
+                self.last_poll_rtt = response.elapsed.total_seconds()
                 return response.json()
             if response.status_code == 204: return None
             response.raise_for_status()
         except requests.RequestException:
+            METRICS.inc("spotify_poll_errors_total")
             return None
         return None
 
-class LyricsFetcher:
-    def get_synced_lyrics(self, track_name, artist_name, duration_ms):
-        cleaned_track_name = re.sub(r'[\(\-].*?(Remaster|Live|Acoustic|Version|Edit|Mix|Radio).*', '', track_name, flags=re.IGNORECASE).strip()
-        cleaned_track_name = cleaned_track_name.split('/')[0].strip()
+    def get_queue(self):
+        """Próximas faixas da fila de reprodução (lista de objetos track/episode)."""
+        if self.retry_after() > 0: return []
+        try:
+            response = self._authorized_get(f"{self.BASE_URL}/me/player/queue")
+            if response is None: return []
+            if response.status_code == 429:
+                self._note_rate_limit(response)
+                return []
+            response.raise_for_status()
+            return response.json().get('queue') or []
+        except (requests.RequestException, ValueError):
+            return []
+
+    def iter_saved_tracks(self):
+        """Todas as faixas guardadas na biblioteca do utilizador (scope user-library-read), página a página."""
+        for item in self._iter_pages(f"{self.BASE_URL}/me/tracks?limit=50"):
+            yield item.get('track')
+
+    def iter_playlist_tracks(self, playlist_id):
+        """Todas as faixas de uma playlist (scope playlist-read-private para as privadas), página a página."""
+        fields = "next,items(track(id,name,type,duration_ms,artists(name),album(name)))"
+        url = f"{self.BASE_URL}/playlists/{quote(playlist_id)}/tracks?limit=100&fields={quote(fields)}"
+        for item in self._iter_pages(url):
+            yield item.get('track')
+
+    def _iter_pages(self, url):
+        """Segue os links `next` de um endpoint paginado. Bloqueia durante os 429: só para uso fora da interface."""
+        while url:
+            response = self._authorized_get(url)
+            if response is None:
+                raise PermissionError("não foi possível renovar o token do Spotify")
+            if response.status_code == 429:
+                self._note_rate_limit(response)
+                time.sleep(self.retry_after())
+                continue
+            if response.status_code in (401, 403):
+                raise PermissionError(f"o Spotify recusou {urllib.parse.urlsplit(url).path} ({response.status_code}); "
+                                      "apague spotify_token.json e autentique-se de novo para conceder os scopes necessários")
+            response.raise_for_status()
+            page = response.json()
+            yield from page.get('items') or ()
+            url = page.get('next')
+
+# --- Relógio de reprodução e agendamento das consultas ---
+
+class PlaybackClock:
+    """Relógio de reprodução local: extrapola a posição a partir da última consulta e de time.monotonic().
+
+    Compensa a latência (a posição reportada já tem metade do RTT suavizado quando chega) e corrige
+    pequenos desvios como um PLL de segunda ordem: o erro de fase é absorvido aos poucos, a no máximo
+    MAX_SLEW_RATE do tempo decorrido, e o erro persistente ajusta o ritmo. Só um salto real
+    (nova faixa, pausa/retoma, seek) reposiciona o relógio de uma vez.
+    """
+    SEEK_THRESHOLD_MS = 1500
+    LATENCY_GAIN = 0.125       # EWMA do RTT, como o SRTT do TCP
+    PHASE_GAIN = 0.75          # fração do erro de fase corrigida por sincronização
+    FREQUENCY_GAIN = 0.05      # fração do erro atribuída a diferença de ritmo
+    MAX_RATE_ERROR = 0.005     # ritmo limitado a 1 ± 0,5 %
+    MAX_SLEW_RATE = 0.25       # a correção avança no máximo 250 ms por segundo: a posição nunca recua
 
-        lyrics = self._fetch_from_lrclib(cleaned_track_name, artist_name)
-        if lyrics: return lyrics
-        lyrics = self._fetch_from_megalobiz(cleaned_track_name, artist_name)
-        if lyrics: return lyrics
-        return None
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.track_id = None
+        self.is_playing = False
+        self.duration_ms = 0
+        self.latency_ms = None     # latência de ida suavizada (RTT / 2)
+        self._rate = 1.0
+        self._slew_ms = 0.0
+        self._anchor_ms = 0
+        self._anchor_time = time.monotonic()
+
+    def update(self, track_id, progress_ms, duration_ms, is_playing, rtt=None):
+        """Sincroniza com o estado do Spotify (rtt em segundos, se medido). Devolve True se houve descontinuidade (nova faixa, salto, pausa/retoma)."""
+        now = time.monotonic()
+        with self._lock:
+            if rtt is not None:
+                one_way_ms = rtt * 500
+                self.latency_ms = one_way_ms if self.latency_ms is None else \
+                    self.latency_ms + self.LATENCY_GAIN * (one_way_ms - self.latency_ms)
+            observed_ms = progress_ms + (self.latency_ms or 0) if is_playing else progress_ms
+            expected_ms = self._position_at(now)
+            error_ms = observed_ms - expected_ms
+            discontinuity = (track_id != self.track_id or is_playing != self.is_playing
+                             or abs(error_ms) > self.SEEK_THRESHOLD_MS)
+            if METRICS.enabled and not discontinuity and is_playing:
+                # Desvio entre a posição extrapolada (a usada para as letras) e a reportada.
+                METRICS.observe("lyrics_clock_drift_seconds", abs(error_ms) / 1000)
+                METRICS.set_gauge("lyrics_clock_drift_ms", round(error_ms))
+                METRICS.set_gauge("spotify_latency_ms", round(self.latency_ms or 0))
+            if discontinuity or not is_playing:
+                self._anchor_ms = observed_ms
+                self._slew_ms = 0.0
+            else:
+                elapsed_ms = (now - self._anchor_time) * 1000
+                if elapsed_ms > 500:
+                    self._rate = min(1 + self.MAX_RATE_ERROR, max(1 - self.MAX_RATE_ERROR,
+                                     self._rate + self.FREQUENCY_GAIN * error_ms / elapsed_ms))
+                self._anchor_ms = expected_ms
+                self._slew_ms = self.PHASE_GAIN * error_ms
+            self.track_id = track_id
+            self.is_playing = is_playing
+            self.duration_ms = duration_ms or 0
+            self._anchor_time = now
+        return discontinuity
+
+    def reset(self):
+        with self._lock:
+            self.track_id = None
+            self.is_playing = False
+            self.duration_ms = 0
+            self._slew_ms = 0.0
+            self._anchor_ms = 0
+            self._anchor_time = time.monotonic()
+
+    def _position_at(self, now):
+        position_ms = self._anchor_ms
+        if self.is_playing:
+            elapsed_ms = (now - self._anchor_time) * 1000
+            max_slew = elapsed_ms * self.MAX_SLEW_RATE
+            position_ms += elapsed_ms * self._rate + max(-max_slew, min(max_slew, self._slew_ms))
+        return min(position_ms, self.duration_ms) if self.duration_ms else position_ms
+
+    def position(self):
+        with self._lock:
+            return int(self._position_at(time.monotonic()))
+
+    def remaining_ms(self):
+        with self._lock:
+            return max(0, self.duration_ms - self._position_at(time.monotonic()))
+
+    def ms_until(self, position_ms):
+        """Tempo real (ms) até o relógio chegar a position_ms, contando com o ritmo e a correção
+        ainda por absorver; None se estiver em pausa."""
+        with self._lock:
+            if not self.is_playing: return None
+            elapsed_ms = (time.monotonic() - self._anchor_time) * 1000
+            distance_ms = position_ms - self._anchor_ms
+            # Enquanto houver correção por absorver, a posição avança a rate ± MAX_SLEW_RATE.
+            slew_end_ms = abs(self._slew_ms) / self.MAX_SLEW_RATE
+            slewing_rate = self._rate + math.copysign(self.MAX_SLEW_RATE, self._slew_ms)
+            target_ms = distance_ms / slewing_rate
+            if target_ms > slew_end_ms:
+                target_ms = (distance_ms - self._slew_ms) / self._rate
+            return max(0.0, target_ms - elapsed_ms)
+
+class LyricsOffsets:
+    """Desvio manual das letras por faixa (LRC adiantados ou atrasados), gravado em lyrics_offsets.json.
+
+    Positivo atrasa as letras: a linha mostrada é a de posição - desvio.
+    """
+    PATH = 'lyrics_offsets.json'
+    STEP_MS = 250
+
+    def __init__(self, path=None):
+        self.path = path or self.PATH
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._offsets = {track_id: int(value) for track_id, value in json.load(f).items()}
+        except (FileNotFoundError, json.JSONDecodeError, AttributeError, TypeError, ValueError):
+            self._offsets = {}
+
+    def get(self, track_id):
+        return self._offsets.get(track_id, 0)
+
+    def adjust(self, track_id, delta_ms):
+        """Soma delta_ms ao desvio da faixa (0 repõe) e grava; devolve o novo desvio."""
+        value = self.get(track_id) + delta_ms if delta_ms else 0
+        if value:
+            self._offsets[track_id] = value
+        else:
+            self._offsets.pop(track_id, None)
+        self._save()
+        return value
 
-    def _fetch_from_lrclib(self, track_name, artist_name):
+    def _save(self):
         try:
-            api_url = f"https://lrclib.net/api/search?track_name={quote(track_name)}&artist_name={quote(artist_name)}"
-            response = requests.get(api_url, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            if data and data[0].get('syncedLyrics'):
-                return self._parse_lrc(data[0]['syncedLyrics'])
+            _atomic_write_json(self.path, self._offsets)
+        except OSError as e:
+            print(f"Aviso: não foi possível gravar os desvios das letras: {e}")
+
+class PollScheduler:
+    """Decide quando voltar a consultar o Spotify, em vez de um intervalo fixo de 1 s."""
+    STEADY_INTERVAL = 10.0     # a tocar sem eventos: o PlaybackClock extrapola entretanto
+    PAUSED_INTERVAL = 1.5      # em pausa não há como prever quando a música retoma
+    SEEK_INTERVAL = 1.0        # depois de um salto ou mudança de estado, confirma depressa
+    SEEK_FAST_POLLS = 3
+    NEAR_END_MARGIN = 0.3      # acorda logo após o fim previsto da faixa
+    MIN_INTERVAL = 0.5
+    IDLE_MIN_INTERVAL = 2.0    # sem reprodução: recua exponencialmente até IDLE_MAX_INTERVAL
+    IDLE_MAX_INTERVAL = 30.0
+    HIDDEN_INTERVAL = 30.0     # janela escondida: só para dar pela mudança de faixa; ao mostrar, consulta logo
+
+    def __init__(self):
+        self._fast_polls_left = 0
+        self._idle_interval = self.IDLE_MIN_INTERVAL
+
+    def next_delay(self, clock, has_playback, discontinuity=False, retry_after=0, hidden=False):
+        if retry_after > 0:
+            return max(retry_after, self.MIN_INTERVAL)
+        if hidden:
+            return self.HIDDEN_INTERVAL
+
+        if not has_playback:
+            delay = self._idle_interval
+            self._idle_interval = min(self._idle_interval * 2, self.IDLE_MAX_INTERVAL)
+            return delay
+        self._idle_interval = self.IDLE_MIN_INTERVAL
+
+        if discontinuity:
+            self._fast_polls_left = self.SEEK_FAST_POLLS
+        if not clock.is_playing:
+            return self.PAUSED_INTERVAL
+
+        if self._fast_polls_left > 0:
+            self._fast_polls_left -= 1
+            delay = self.SEEK_INTERVAL
+        else:
+            delay = self.STEADY_INTERVAL
+        until_track_end = clock.remaining_ms() / 1000 + self.NEAR_END_MARGIN
+        return max(self.MIN_INTERVAL, min(delay, until_track_end))
+
+class LyricsTimeline:
+    """Linha temporal compacta das letras: timestamps e textos em arrays paralelos, com pesquisa binária."""
+    __slots__ = ('times', 'texts', '_cursor')
+
+    def __init__(self, times, texts):
+        self.times = array('i', times)  # ms; int32 chega para ~24 dias de áudio
+        self.texts = list(texts)
+        self._cursor = -1
+
+    @classmethod
+    def from_buffer(cls, times, texts):
+        """Sem cópia: times pode ser qualquer sequência indexável de int32, por ex. um memoryview sobre um mmap."""
+        timeline = cls.__new__(cls)
+        timeline.times, timeline.texts, timeline._cursor = times, texts, -1
+        return timeline
+
+    def __len__(self):
+        return len(self.times)
+
+    def index_at(self, position_ms):
+        """Índice da linha ativa em position_ms (-1 antes da primeira linha).
+
+        Em reprodução contínua o cursor avança no máximo uma linha por chamada (O(1));
+        após um salto (seek) recorre a bisect (O(log n)).
+        """
+        times = self.times
+        n = len(times)
+        i = self._cursor
+        if i < 0 or times[i] <= position_ms:
+            if i + 1 >= n or position_ms < times[i + 1]:
+                return i
+            j = i + 1
+            if j + 1 >= n or position_ms < times[j + 1]:
+                self._cursor = j
+                return j
+        self._cursor = bisect_right(times, position_ms) - 1
+        return self._cursor
+
+    def next_change_ms(self, position_ms):
+        """Instante (ms) da próxima mudança de linha depois de position_ms, ou None se já for a última."""
+        i = self.index_at(position_ms) + 1
+        return self.times[i] if i < len(self.times) else None
+
+    def lines_at(self, position_ms):
+        """Devolve (linha atual, linha seguinte) para a posição indicada."""
+        if not self.texts: return "", ""
+        i = self.index_at(position_ms)
+        current_text = self.texts[i] if i >= 0 else ""
+        next_text = self.texts[i + 1] if i + 1 < len(self.texts) else ""
+        return current_text, next_text
+
+    def to_dict(self):
+        return {'times': self.times.tolist(), 'texts': self.texts}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['times'], data['texts'])
+
+class PersistentLRUCache:
+    """Cache persistente em disco (SQLite) com despejo LRU limitado por tamanho e TTL por entrada."""
+
+    def __init__(self, path, max_bytes=20 * 1024 * 1024, default_ttl=30 * 86400):
+        self.path = path
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        try:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_last_access ON cache(last_access)")
+            self._conn.commit()
+        except sqlite3.Error as e:
+            print(f"Aviso: cache em disco indisponível ({path}): {e}")
+            self._conn = None
+
+    def lookup(self, key):
+        """Devolve (encontrado, valor). Um valor None em cache também conta como encontrado."""
+        if self._conn is None: return False, None
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    METRICS.inc("cache_lookups_total", cache=self.name, result="miss")
+                    return False, None
+                if row[1] < now:
+                    self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    self._conn.commit()
+                    METRICS.inc("cache_lookups_total", cache=self.name, result="expired")
+                    return False, None
+                self._conn.execute("UPDATE cache SET last_access = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+                METRICS.inc("cache_lookups_total", cache=self.name, result="hit")
+                return True, json.loads(row[0])
+            except (sqlite3.Error, ValueError):
+                return False, None
+
+    def put(self, key, value, ttl=None):
+        if self._conn is None: return
+        now = time.time()
+        payload = json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+        expires_at = now + (self.default_ttl if ttl is None else ttl)
+        with self._lock:
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (key, payload, len(payload), expires_at, now)
+                )
+                self._evict(now)
+                self._conn.commit()
+            except sqlite3.Error as e:
+                print(f"Aviso: falha ao gravar na cache: {e}")
+
+    def delete(self, key):
+        if self._conn is None: return
+        with self._lock:
+            try:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._conn.commit()
+            except sqlite3.Error as e:
+                print(f"Aviso: falha ao apagar da cache: {e}")
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes: return
+        excess = total - self.max_bytes
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM cache ORDER BY last_access ASC"):
+            victims.append((key,))
+            excess -= size
+            if excess <= 0: break
+        self._conn.executemany("DELETE FROM cache WHERE key = ?", victims)
+
+class LyricsStore:
+    """Armazém compacto de letras por ID de faixa do Spotify, para catálogos pré-carregados grandes.
+
+    Dois ficheiros só de acréscimo: `<base>.dat` com um registo por faixa (timestamps int32
+    empacotados, índices para a tabela de textos e a tabela de textos sem repetições,
+    comprimida com zlib) e `<base>.idx`, um registo fixo por escrita (ID, offset, tamanho);
+    a última entrada de cada ID prevalece. O .dat é lido por mmap e os timestamps da faixa
+    pedida ficam como memoryview sobre o mapa, sem cópia; só os textos são descomprimidos.
+    """
+    _INDEX_RECORD = struct.Struct('<22sQI')
+    _HEADER = struct.Struct('<III')  # linhas, textos distintos, bytes comprimidos
+
+    def __init__(self, base_path='lyrics_store'):
+        self.data_path = base_path + '.dat'
+        self.index_path = base_path + '.idx'
+        self._lock = threading.Lock()
+        self._index = {}
+        self._index_bytes_read = 0
+        self._map = None
+        self._mapped_size = 0
+        try:
+            self._load_index()
+        except OSError as e:
+            print(f"Aviso: armazém de letras indisponível ({base_path}): {e}")
+
+    def __contains__(self, track_id):
+        return track_id in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def _load_index(self):
+        """Lê os registos do .idx ainda não vistos (também os acrescentados por outro processo, como o pré-carregamento)."""
+        if not os.path.exists(self.index_path): return
+        data_size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        record_size = self._INDEX_RECORD.size
+        with open(self.index_path, 'rb') as f:
+            f.seek(self._index_bytes_read)
+            raw = f.read()
+        complete = len(raw) - len(raw) % record_size  # um registo a meio de ser escrito fica para a próxima leitura
+        for start in range(0, complete, record_size):
+            track_id, offset, length = self._INDEX_RECORD.unpack_from(raw, start)
+            if offset + length <= data_size:  # entradas de uma escrita interrompida apontam para lá do fim
+                self._index[track_id.rstrip(b'\0').decode('ascii')] = (offset, length)
+        self._index_bytes_read += complete
+
+    def get(self, track_id):
+        """Devolve (encontrado, LyricsTimeline), como PersistentLRUCache.lookup."""
+        entry = self._index.get(track_id)
+        if entry is None:
+            try:
+                with self._lock:
+                    self._load_index()
+            except OSError:
+                pass
+            entry = self._index.get(track_id)
+            if entry is None: return False, None
+        offset, length = entry
+        try:
+            view = self._view(offset + length)
+            n_lines, n_texts, compressed_size = self._HEADER.unpack_from(view, offset)
+            start = offset + self._HEADER.size
+            times = view[start:start + 4 * n_lines].cast('i')
+            start += 4 * n_lines
+            text_ids = view[start:start + 4 * n_lines].cast('I')
+            start += 4 * n_lines
+            table = zlib.decompress(view[start:start + compressed_size]).decode('utf-8').split('\0')
+        except (OSError, ValueError, zlib.error) as e:
+            print(f"Aviso: registo de letras corrompido ({track_id}): {e}")
+            return False, None
+        return True, LyricsTimeline.from_buffer(times, [table[i] for i in text_ids])
+
+    def _view(self, end):
+        """memoryview do .dat mapeado, remapeado se o ficheiro cresceu desde o último mapeamento.
+
+        Um mapa antigo não é fechado: as linhas temporais já entregues continuam a apontar para ele
+        e é libertado quando deixarem de existir.
+        """
+        with self._lock:
+            if self._map is None or end > self._mapped_size:
+                with open(self.data_path, 'rb') as f:
+                    self._map = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+                self._mapped_size = len(self._map)
+            return self._map
+
+    def put(self, track_id, timeline):
+        """Acrescenta (ou substitui) as letras de uma faixa. Os resultados negativos ficam na cache com TTL, não aqui."""
+        key = track_id.encode('ascii')
+        if len(key) > 22: raise ValueError(f"ID de faixa inválido: {track_id}")
+        table, text_ids = {}, array('I')
+        for text in timeline.texts:
+            text_ids.append(table.setdefault(text, len(table)))
+        compressed = zlib.compress('\0'.join(table).encode('utf-8'))
+        times = timeline.times if isinstance(timeline.times, array) else array('i', timeline.times)
+        record = b''.join((self._HEADER.pack(len(times), len(table), len(compressed)),
+                           times.tobytes(), text_ids.tobytes(), compressed))
+        with self._lock:
+            try:
+                with open(self.data_path, 'ab') as f:
+                    f.write(record)
+                    f.flush()
+                    offset = f.tell() - len(record)  # em modo de acréscimo a escrita vai sempre para o fim, mesmo com outro processo
+                with open(self.index_path, 'ab') as f:
+                    f.write(self._INDEX_RECORD.pack(key, offset, len(record)))
+            except OSError as e:
+                print(f"Aviso: falha ao gravar no armazém de letras: {e}")
+                return
+            self._index[track_id] = (offset, len(record))
+
+# --- Fontes de letras (providers) ---
+
+# track_name já vem limpo (sem "- Remastered", etc.) para as pesquisas aproximadas; raw_track_name é o
+# título tal como o Spotify o dá, para consultas por assinatura exata. Sem ele, usa-se track_name.
+TrackQuery = namedtuple('TrackQuery', ['track_name', 'artist_name', 'duration_ms', 'album_name', 'raw_track_name'],
+                        defaults=(None, None))
+
+_LRC_LINE = re.compile(r'^[ \t]*\[(\d{1,3}):(\d{1,2}(?:[.:]\d{1,3})?)\](.*)', re.M)
+_LRC_STACKED_TAGS = re.compile(r'\][ \t]*\[\d')  # várias marcas de tempo seguidas, com ou sem espaço
+_LRC_WORD_LINE = re.compile(r'^[ \t]*(<\d{1,3}:\d{1,2}(?:[.:]\d{1,3})?>[^\r\n]*)', re.M)
+_LRC_TIME_TAG = re.compile(r'\[(\d{1,3}):(\d{1,2})(?:[.:](\d{1,3}))?\]')
+_LRC_WORD_TAG = re.compile(r'<(\d{1,3}):(\d{1,2})(?:[.:](\d{1,3}))?>')
+_LRC_OFFSET_TAG = re.compile(r'^[ \t]*\[offset:[ \t]*([+-]?\d+)[ \t]*\]', re.M | re.I)
+_FRACTION_SCALE = (0, 100, 10, 1)  # 1, 2 ou 3 dígitos -> ms
+
+def _lrc_tag_ms(match):
+    minutes, seconds, fraction = match.groups()
+    time_ms = int(minutes) * 60000 + int(seconds) * 1000
+    if fraction:
+        time_ms += int(fraction) * _FRACTION_SCALE[len(fraction)]
+    return time_ms
+
+class _LrcFieldTable(dict):
+    """Memoriza a conversão 'mm' / 'ss.xx' -> ms, para converter colunas inteiras com map() sem int() por linha.
+
+    Limitada a MAX_SIZE entradas: ao encher esvazia-se (os valores comuns voltam a entrar logo), o que
+    mantém o acesso como um dict simples.
+    """
+    __slots__ = ('_unit_ms',)
+    MAX_SIZE = 8192  # 'ss.xx' tem 6000 valores distintos; 'ss.xxx' enche a tabela aos poucos
+
+    def __init__(self, unit_ms):
+        super().__init__()
+        self._unit_ms = unit_ms
+
+    def __missing__(self, field):
+        if len(self) >= self.MAX_SIZE: self.clear()
+        whole, _, fraction = field.replace(':', '.').partition('.')
+        value = int(whole) * self._unit_ms
+        if fraction:
+            value += int(fraction) * _FRACTION_SCALE[len(fraction)]
+        self[field] = value
+        return value
+
+_LRC_MINUTES_MS = _LrcFieldTable(60000)
+_LRC_SECONDS_MS = _LrcFieldTable(1000)
+
+class LrcParser:
+    """Parser LRC incremental, de uma só passagem, que produz diretamente um LyricsTimeline.
+
+    Aceita [mm:ss], [mm:ss.xx], [mm:ss.xxx] e [mm:ss:xx], várias marcas de tempo na mesma linha,
+    a etiqueta [offset:±ms] e marcas de palavra <mm:ss.xx> (LRC melhorado/A2), removidas do texto.
+    O texto pode chegar aos bocados via feed(), por exemplo de uma resposta HTTP em streaming;
+    cada bloco de linhas completas é percorrido de uma vez por uma regex multilinha.
+    """
+    __slots__ = ('_times', '_texts', '_pending', '_offset_ms', '_ordered')
+
+    def __init__(self):
+        self._times = array('i')
+        self._texts = []
+        self._pending = ''
+        self._offset_ms = 0
+        self._ordered = True
+
+    def feed(self, chunk):
+        if '\r' in chunk:
+            # CRLF e CR isolado (ficheiros antigos de Mac) passam a '\n'; um CRLF partido entre blocos só dá uma linha vazia.
+            chunk = chunk.replace('\r\n', '\n').replace('\r', '\n')
+        if self._pending:
+            chunk = self._pending + chunk
+        cut = chunk.rfind('\n') + 1
+        self._pending = chunk[cut:]
+        if cut: self._parse_block(chunk[:cut])
+
+    def close(self):
+        if self._pending:
+            self._parse_block(self._pending)
+            self._pending = ''
+        return self._build()
+
+    def _parse_block(self, block):
+        rows = _LRC_LINE.findall(block)
+        if rows:
+            if '<' in block or _LRC_STACKED_TAGS.search(block):
+                self._append_rows_slow(rows)
+            else:
+                self._append_rows(*zip(*rows))
+
+        if '<' in block:
+            # linhas sem marca de linha, só com marcas de palavra: a primeira dá o início da linha
+            for text in _LRC_WORD_LINE.findall(block):
+                time_ms = _lrc_tag_ms(_LRC_WORD_TAG.match(text.lstrip()))
+                text = _LRC_WORD_TAG.sub('', text).strip()
+                if text:
+                    self._ordered = False
+                    self._times.append(time_ms)
+                    self._texts.append(text)
+
+        if 'ffset' in block:
+            match = _LRC_OFFSET_TAG.search(block)
+            if match: self._offset_ms = int(match.group(1))
+
+    def _append_rows(self, minutes, seconds, texts):
+        """Caminho rápido (uma marca por linha, sem marcas de palavra): tudo convertido coluna a coluna."""
+        times = list(map(add, map(_LRC_MINUTES_MS.__getitem__, minutes), map(_LRC_SECONDS_MS.__getitem__, seconds)))
+        texts = list(map(str.strip, texts))
+        if '' in texts:
+            keep = list(map(bool, texts))
+            times, texts = list(compress(times, keep)), list(compress(texts, keep))
+        if not times: return
+        if self._ordered:
+            self._ordered = (not self._times or self._times[-1] <= times[0]) and all(map(le, times, islice(times, 1, None)))
+        self._times.extend(times)
+        self._texts.extend(texts)
+
+    def _append_rows_slow(self, rows):
+        times, texts = self._times, self._texts
+        ordered = self._ordered
+        for minutes, seconds, text in rows:
+            time_ms = _LRC_MINUTES_MS[minutes] + _LRC_SECONDS_MS[seconds]
+            stamps = [time_ms]
+            text = text.lstrip()
+            if text.startswith('['):
+                # várias marcas de tempo: a mesma linha repete-se em cada uma
+                match = _LRC_TIME_TAG.match(text)
+                while match:
+                    stamps.append(_lrc_tag_ms(match))
+                    text = text[match.end():].lstrip()
+                    match = _LRC_TIME_TAG.match(text)
+            if '<' in text:
+                text = _LRC_WORD_TAG.sub('', text)
+            text = text.strip()
+            if not text: continue
+            if len(stamps) > 1 or (times and time_ms < times[-1]):
+                ordered = False
+            for time_ms in stamps:
+                times.append(time_ms)
+                texts.append(text)
+        self._ordered = ordered
+
+    def _build(self):
+        times, texts = self._times, self._texts
+        if not times: return None
+        if not self._ordered:
+            order = sorted(range(len(times)), key=times.__getitem__)
+            times = array('i', [times[i] for i in order])
+            texts = [texts[i] for i in order]
+        if self._offset_ms:
+            # offset positivo faz as letras aparecerem mais cedo
+            times = array('i', [max(0, t - self._offset_ms) for t in times])
+        return LyricsTimeline(times, texts)
+
+def parse_lrc(lrc_text):
+    parser = LrcParser()
+    parser.feed(lrc_text)
+    return parser.close()
+
+class LyricsProvider:
+    """Fonte de letras sincronizadas. Para acrescentar uma fonte basta implementar fetch() e registá-la no LyricsFetcher."""
+    name = "base"
+    priority = 100  # menor = preferida quando várias fontes respondem
+
+    def __init__(self, session):
+        self.http = session
+
+    def fetch(self, query, cancel_event):
+        """Devolve um LyricsTimeline, ou None se a fonte não tiver letras.
+
+        Falhas de rede devem propagar requests.RequestException; fontes com vários pedidos
+        devem consultar cancel_event entre eles e desistir quando estiver ativo.
+        """
+        raise NotImplementedError
+
+def _search_tokens(text):
+    """Tokens normalizados para comparação: sem acentos, casefold, só alfanuméricos."""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return tuple(re.findall(r'\w+', stripped.casefold()))
+
+def _token_similarity(a, b):
+    """Semelhança entre duas sequências de tokens: coeficiente de Dice, ou a razão de caracteres se for maior (gralhas)."""
+    if not a or not b: return 0.0
+    set_a, set_b = set(a), set(b)
+    dice = 2 * len(set_a & set_b) / (len(set_a) + len(set_b))
+    if dice == 1.0: return dice
+    return max(dice, SequenceMatcher(None, ' '.join(a), ' '.join(b)).ratio())
+
+@lru_cache(maxsize=4096)
+def _lrclib_match_score(title_tokens, artist_tokens, duration_ms, candidate_title, candidate_artist, candidate_duration_s):
+    """Pontuação (0..1) de um resultado do /api/search, ou None se a duração estiver fora da janela."""
+    duration_score = 0.5
+    if duration_ms and candidate_duration_s:
+        delta_ms = abs(candidate_duration_s * 1000 - duration_ms)
+        if delta_ms > LrclibProvider.DURATION_WINDOW_MS: return None
+        duration_score = 1 - delta_ms / LrclibProvider.DURATION_WINDOW_MS
+    title_score = _token_similarity(title_tokens, _search_tokens(LyricsFetcher.clean_track_name(candidate_title or '')))
+    artist_score = _token_similarity(artist_tokens, _search_tokens(candidate_artist))
+    return 0.5 * title_score + 0.2 * artist_score + 0.3 * duration_score
+
+class LrclibProvider(LyricsProvider):
+    """LRCLIB: primeiro a assinatura exata (/api/get com álbum e duração), depois a melhor entrada do /api/search.
+
+    Os resultados da pesquisa sem letra sincronizada (ou instrumentais) são ignorados e os
+    restantes ordenados por semelhança do título/artista e diferença de duração; as
+    pontuações ficam memorizadas, já que as mesmas entradas voltam em pesquisas repetidas.
+    """
+    name = "lrclib"
+    priority = 10
+    BASE_URL = "https://lrclib.net"
+    DURATION_WINDOW_MS = 8000   # além disto é quase certo ser outra versão (ao vivo, edit, ...)
+    MIN_SCORE = 0.6
+
+    def fetch(self, query, cancel_event):
+        try:
+            if query.album_name and query.duration_ms:
+                lyrics = self._fetch_exact(query, cancel_event)
+                if lyrics or cancel_event.is_set(): return lyrics
+            return self._fetch_best_match(query, cancel_event)
+        except requests.RequestException:
+            raise
         except Exception:
             return None
 
-    def _fetch_from_megalobiz(self, track_name, artist_name):
-        try:
-            search_url = f"https://www.megalobiz.com/search/all?qry={quote(f'{track_name} {artist_name}')}"
-            headers = {'User-Agent': 'Mozilla/5.0'}
-            search_response = requests.get(search_url, headers=headers, timeout=10)
-            search_response.raise_for_status()
-            soup = BeautifulSoup(search_response.text, 'html.parser')
-            lyrics_link = soup.find('a', class_='entity_name')
-            if not lyrics_link: return None
-            lyrics_page_url = f"https://www.megalobiz.com{lyrics_link['href']}"
-            lyrics_response = requests.get(lyrics_page_url, headers=headers, timeout=10)
-            lyrics_response.raise_for_status()
-            page_soup = BeautifulSoup(lyrics_response.text, 'html.parser')
-            lrc_text_span = page_soup.find('span', {'id': 'lrc_text'})
-            if not lrc_text_span: return None
-            return self._parse_lrc(lrc_text_span.get_text(separator='\n'))
+    def _fetch_exact(self, query, cancel_event):
+        params = {'track_name': query.raw_track_name or query.track_name, 'artist_name': query.artist_name,
+                  'album_name': query.album_name, 'duration': round(query.duration_ms / 1000)}
+        response = self.http.get(f"{self.BASE_URL}/api/get", params=params, cancel_event=cancel_event)
+        if response.status_code == 404: return None
+        response.raise_for_status()
+        data = response.json()
+        if data.get('syncedLyrics') and not data.get('instrumental'):
+            return parse_lrc(data['syncedLyrics'])
+        return None
+
+    def _fetch_best_match(self, query, cancel_event):
+        api_url = f"{self.BASE_URL}/api/search?track_name={quote(query.track_name)}&artist_name={quote(query.artist_name)}"
+        response = self.http.get(api_url, cancel_event=cancel_event)
+        response.raise_for_status()
+        best = self.best_candidate(query, response.json())
+        return parse_lrc(best['syncedLyrics']) if best else None
+
+    @classmethod
+    def best_candidate(cls, query, candidates):
+        title_tokens = _search_tokens(query.track_name)
+        artist_tokens = _search_tokens(query.artist_name)
+        best, best_score = None, None
+        for candidate in candidates or ():
+            if not candidate.get('syncedLyrics') or candidate.get('instrumental'): continue
+            score = _lrclib_match_score(title_tokens, artist_tokens, query.duration_ms, candidate.get('trackName'),
+                                        candidate.get('artistName'), candidate.get('duration'))
+            if score is None or score < cls.MIN_SCORE: continue
+            if best_score is None or score > best_score:
+                best, best_score = candidate, score
+        return best
+
+class _MegalobizLinkParser(HTMLParser):
+    """Procura só o primeiro <a class="entity_name"> da página de resultados."""
+
+    def __init__(self):
+        super().__init__()
+        self.href = None
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag != 'a' or self.done: return
+        attrs = dict(attrs)
+        if 'entity_name' in (attrs.get('class') or '').split() and attrs.get('href'):
+            self.href = attrs['href']
+            self.done = True
+
+class _MegalobizLyricsParser(HTMLParser):
+    """Passa o texto de <span id="lrc_text"> ao LrcParser à medida que chega, uma linha por nó de texto.
+
+    O HTMLParser pode entregar um nó de texto em vários pedaços (nos limites dos blocos), por isso
+    o texto só segue para o LrcParser na tag seguinte.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.lrc = LrcParser()
+        self.found = False
+        self.done = False
+        self._depth = 0
+        self._text = []
+
+    def _flush_text(self):
+        if self._text:
+            self.lrc.feed(''.join(self._text) + '\n')
+            self._text.clear()
+
+    def handle_starttag(self, tag, attrs):
+        if self._depth:
+            self._flush_text()
+            if tag == 'span': self._depth += 1
+        elif tag == 'span' and not self.done and ('id', 'lrc_text') in attrs:
+            self.found = True
+            self._depth = 1
+
+    def handle_endtag(self, tag):
+        if self._depth:
+            self._flush_text()
+            if tag == 'span':
+                self._depth -= 1
+                if not self._depth: self.done = True
+
+    def handle_data(self, data):
+        if self._depth:
+            self._text.append(data)
+
+class MegalobizProvider(LyricsProvider):
+    """Megalobiz: página de pesquisa e depois a página da letra, ambas lidas em streaming.
+
+    O HTML é passado a um HTMLParser mínimo bloco a bloco e o download pára assim que o
+    elemento procurado aparece (o link fica a meio da página de resultados). O URL da página
+    da letra para cada pesquisa fica em cache, evitando a pesquisa em consultas repetidas.
+    """
+    name = "megalobiz"
+    priority = 20
+    BASE_URL = "https://www.megalobiz.com"
+    HEADERS = {'User-Agent': 'Mozilla/5.0'}
+    STREAM_CHUNK = 8 * 1024
+    DRAIN_LIMIT = 64 * 1024
+    PAGE_URL_TTL = 30 * 86400
+    GONE_STATUS = (404, 410)
+
+    def __init__(self, session, page_urls=None):
+        super().__init__(session)
+        self.page_urls = page_urls if page_urls is not None else PersistentLRUCache(
+            'megalobiz_cache.sqlite3', max_bytes=1024 * 1024, default_ttl=self.PAGE_URL_TTL)
+
+    def fetch(self, query, cancel_event):
+        try:
+            search_query = f'{query.track_name} {query.artist_name}'
+            cache_key = search_query.casefold()
+            found, page_path = self.page_urls.lookup(cache_key)
+            while True:
+                if not found:
+                    link = self._stream_parse(f"{self.BASE_URL}/search/all?qry={quote(search_query)}", _MegalobizLinkParser(), cancel_event)
+                    if not link or not link.href: return None
+                    page_path = link.href
+                    self.page_urls.put(cache_key, page_path)
+                if cancel_event.is_set(): return None
+                try:
+                    page = self._stream_parse(f"{self.BASE_URL}{page_path}", _MegalobizLyricsParser(), cancel_event)
+                    break
+                except requests.HTTPError as e:
+                    if e.response is None or e.response.status_code not in self.GONE_STATUS: raise
+                    # Página removida: esquece o URL; se vinha da cache, pesquisa de novo, senão não há letra.
+                    self.page_urls.delete(cache_key)
+                    if not found: return None
+                    found = False
+            if not page or not page.found: return None
+            return page.lrc.close()
+        except requests.RequestException:
+            raise
         except Exception:
             return None
 
-    def _parse_lrc(self, lrc_text):
-        lyrics = []
-        lrc_regex = re.compile(r'\[(\d{2}):(\d{2})\.(\d{2})\](.*)')
-        for line in lrc_text.splitlines():
-            match = lrc_regex.match(line)
-            if match:
-                minutes, seconds, hundredths, text = match.groups()
-                time_ms = int(minutes) * 60000 + int(seconds) * 1000 + int(hundredths) * 10
-                text = text.strip()
-                if text: lyrics.append({'time': time_ms, 'text': text})
-        lyrics.sort(key=lambda x: x['time'])
-        return lyrics if lyrics else None
+    def _stream_parse(self, url, parser, cancel_event):
+        """Alimenta parser com a resposta em blocos; devolve-o quando parser.done, ou None se cancelado.
+
+        Depois de encontrado o elemento, o resto só é lido (sem parsing) se for pequeno, para a
+        ligação keep-alive voltar ao pool; senão a resposta é fechada a meio.
+        """
+        with self.http.get(url, headers=self.HEADERS, stream=True, cancel_event=cancel_event) as response:
+            response.raise_for_status()
+            decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+            chunks = response.iter_content(chunk_size=self.STREAM_CHUNK)
+            received = 0
+            for chunk in chunks:
+                if cancel_event.is_set(): return None
+                received += len(chunk)
+                parser.feed(decoder.decode(chunk))
+                if parser.done:
+                    remaining = int(response.headers.get('Content-Length') or 0) - received
+                    if 0 < remaining <= self.DRAIN_LIMIT:
+                        for _ in chunks: pass
+                    return parser
+            parser.feed(decoder.decode(b'', final=True))
+            parser.close()
+        return parser
+
+_LRC_HEADER_TAG = re.compile(rb'\[(ti|ar|al|length|offset)\s*:([^\]\r\n]*)\]', re.IGNORECASE)
+_LRC_FIRST_TIMESTAMP = re.compile(rb'^[ \t]*\[\d{1,3}:\d', re.MULTILINE)
+
+class LocalLrcProvider(LyricsProvider):
+    """Letras a partir de coleções locais de ficheiros .lrc, sem rede.
+
+    As pastas são percorridas numa thread em segundo plano (e revistas a cada RESCAN_INTERVAL, só
+    com stat()), sem atrasar as pesquisas, que usam o índice já carregado. O resultado fica num índice SQLite persistente: título/artista normalizados, duração e o
+    offset em bytes da primeira linha com tempo. A pesquisa usa um índice invertido de tokens
+    do título em memória e confirma a duração; a letra escolhida é lida por mmap a partir do offset.
+    """
+    name = "local"
+    priority = 0
+    HEADER_BYTES = 4096
+    MIN_SCORE = 0.8
+    MAX_CANDIDATES = 16
+    DURATION_TOLERANCE_MS = 3000
+    RESCAN_INTERVAL = 300
+
+    def __init__(self, directories, index_path='lrc_index.sqlite3'):
+        super().__init__(None)
+        self.directories = [os.path.abspath(os.path.expanduser(d)) for d in directories]
+        self._lock = threading.Lock()
+        self._scanned_at = None
+        self._scanning = False
+        self._index = ((), {})  # (entradas, índice invertido), substituído de uma só vez
+        self._conn = sqlite3.connect(index_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS lrc_index ("
+            "path TEXT PRIMARY KEY, mtime REAL NOT NULL, size INTEGER NOT NULL, "
+            "title TEXT NOT NULL, artist TEXT NOT NULL, duration_ms INTEGER, body_offset INTEGER NOT NULL)"
+        )
+        self._conn.commit()
+
+    @classmethod
+    def from_env(cls):
+        """Instância configurada por LYRICS_OVERLAY_LRC_DIRS (pastas separadas por os.pathsep), ou None."""
+        directories = [d for d in os.environ.get("LYRICS_OVERLAY_LRC_DIRS", "").split(os.pathsep) if d]
+        return cls(directories) if directories else None
+
+    def fetch(self, query, cancel_event):
+        self._ensure_index()
+        entry = self.lookup(query)
+        if entry is None or cancel_event.is_set(): return None
+        try:
+            return self._read_lyrics(entry)
+        except (OSError, ValueError):
+            return None
+
+    def lookup(self, query):
+        """Melhor entrada do índice para a consulta, ou None abaixo de MIN_SCORE/fora da tolerância de duração.
+
+        Os candidatos (entradas com algum token do título em comum) são pré-ordenados pelo
+        coeficiente de Dice, barato; só os MAX_CANDIDATES melhores passam à comparação completa.
+        """
+        title_tokens = tuple(dict.fromkeys(_search_tokens(query.track_name)))
+        if not title_tokens: return None
+        artist_tokens = _search_tokens(query.artist_name)
+        entries, postings = self._index
+        shared = Counter()
+        for token in title_tokens:
+            shared.update(postings.get(token, ()))
+        shortlist = []
+        for i, common in shared.items():
+            entry = entries[i]
+            duration_ms = entry[3]
+            delta = abs(duration_ms - query.duration_ms) if duration_ms and query.duration_ms else None
+            if delta is not None and delta > self.DURATION_TOLERANCE_MS: continue
+            shortlist.append((2 * common / (len(title_tokens) + len(entry[1])), i, delta))
+        best, best_rank = None, None
+        for _dice, i, delta in heapq.nlargest(self.MAX_CANDIDATES, shortlist):
+            entry = entries[i]
+            artist_score = _token_similarity(artist_tokens, entry[2]) if entry[2] else 0.5
+            score = 0.65 * _token_similarity(title_tokens, entry[1]) + 0.35 * artist_score
+            if score < self.MIN_SCORE: continue
+            rank = (score, -(delta if delta is not None else self.DURATION_TOLERANCE_MS))
+            if best_rank is None or rank > best_rank:
+                best, best_rank = entry, rank
+        return best
+
+    @staticmethod
+    def _read_lyrics(entry):
+        path, body_offset = entry[0], entry[4]
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            text = mapped[body_offset:].decode('utf-8-sig' if body_offset == 0 else 'utf-8', errors='replace')
+        return parse_lrc(text)
+
+    def _ensure_index(self):
+        """Lança a revisão das pastas em segundo plano quando está na altura; nunca espera por ela.
+        Na primeira chamada carrega já o índice gravado pela execução anterior."""
+        with self._lock:
+            if self._scanning: return
+            if self._scanned_at is not None and time.monotonic() - self._scanned_at < self.RESCAN_INTERVAL: return
+            self._scanning = True
+            if self._scanned_at is None:
+                try:
+                    self._load_index()
+                except sqlite3.Error as e:
+                    print(f"Aviso: falha ao ler o índice de letras locais: {e}")
+        threading.Thread(target=self._scan, name="lrc-index", daemon=True).start()
+
+    def _scan(self):
+        try:
+            self._rescan()
+            self._load_index()
+        except (OSError, sqlite3.Error) as e:
+            print(f"Aviso: falha ao indexar letras locais: {e}")
+        finally:
+            with self._lock:
+                self._scanned_at = time.monotonic()
+                self._scanning = False
+
+    def _rescan(self):
+        """Atualiza o índice persistente: só relê o cabeçalho dos ficheiros novos ou alterados."""
+        known = {path: (mtime, size) for path, mtime, size in self._conn.execute("SELECT path, mtime, size FROM lrc_index")}
+        seen, changed = set(), []
+        for directory in self.directories:
+            for root, _dirs, files in os.walk(directory):
+                for filename in files:
+                    if not filename.lower().endswith('.lrc'): continue
+                    path = os.path.join(root, filename)
+                    try:
+                        info = os.stat(path)
+                    except OSError:
+                        continue
+                    if info.st_size == 0: continue
+                    seen.add(path)
+                    if known.get(path) != (info.st_mtime, info.st_size):
+                        row = self._index_file(path, info)
+                        if row: changed.append(row)
+        removed = [(path,) for path in known if path not in seen]
+        if changed or removed:
+            self._conn.executemany("INSERT OR REPLACE INTO lrc_index VALUES (?, ?, ?, ?, ?, ?, ?)", changed)
+            self._conn.executemany("DELETE FROM lrc_index WHERE path = ?", removed)
+            self._conn.commit()
+
+    def _index_file(self, path, info):
+        try:
+            with open(path, 'rb') as f:
+                head = f.read(self.HEADER_BYTES)
+        except OSError:
+            return None
+        tags = {}
+        for match in _LRC_HEADER_TAG.finditer(head):
+            tags.setdefault(match.group(1).decode('ascii').lower(), match.group(2).decode('utf-8', errors='replace').strip())
+        first_line = _LRC_FIRST_TIMESTAMP.search(head)
+        # Com [offset:] o cabeçalho tem de ser lido pelo parser; sem linhas com tempo no início, lê-se tudo.
+        body_offset = first_line.start() if first_line and 'offset' not in tags else 0
+
+        stem = os.path.splitext(os.path.basename(path))[0]
+        artist, _, title = stem.partition(' - ') if ' - ' in stem else ('', '', stem)
+        title = LyricsFetcher.clean_track_name(tags.get('ti') or title)
+        artist = tags.get('ar') or artist
+        return (path, info.st_mtime, info.st_size, ' '.join(_search_tokens(title)), ' '.join(_search_tokens(artist)),
+                self._parse_length(tags.get('length')), body_offset)
+
+    @staticmethod
+    def _parse_length(value):
+        if not value: return None
+        try:
+            minutes, _, seconds = value.rpartition(':')
+            return int((int(minutes or 0) * 60 + float(seconds)) * 1000)
+        except ValueError:
+            return None
+
+    def _load_index(self):
+        entries, postings = [], {}
+        for path, title, artist, duration_ms, body_offset in self._conn.execute(
+                "SELECT path, title, artist, duration_ms, body_offset FROM lrc_index"):
+            title_tokens = tuple(dict.fromkeys(title.split()))
+            for token in title_tokens:
+                postings.setdefault(token, []).append(len(entries))
+            entries.append((path, title_tokens, tuple(artist.split()), duration_ms, body_offset))
+        # As pesquisas em curso continuam a ver o par antigo até esta atribuição.
+        self._index = (tuple(entries), postings)
+
+class LyricsFetcher:
+    CACHE_TTL = 30 * 86400          # letras encontradas: 30 dias
+    NEGATIVE_CACHE_TTL = 86400      # "sem letras": 1 dia, para voltar a tentar mais tarde
+    RACE_TIMEOUT = 12               # limite total da corrida entre fontes, em segundos
+    RANK_GRACE = 0.75               # após o primeiro resultado, espera breve por fontes preferidas ainda em curso
+    CANCEL_CHECK_INTERVAL = 0.25
+
+    def __init__(self, cache=None, session=None, providers=None, store=None):
+        self.http = session if session is not None else HttpSession()
+        self.cache = cache if cache is not None else PersistentLRUCache('lyrics_cache.sqlite3', default_ttl=self.CACHE_TTL)
+        self.store = store if store is not None else LyricsStore()
+        self.providers = list(providers) if providers is not None else [LrclibProvider(self.http), MegalobizProvider(self.http)]
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="lyrics-provider")
+        self._closed = threading.Event()
+
+    def add_provider(self, provider):
+        self.providers.append(provider)
+
+    @staticmethod
+    def clean_track_name(track_name):
+        cleaned_track_name = re.sub(r'[\(\-].*?(Remaster|Live|Acoustic|Version|Edit|Mix|Radio).*', '', track_name, flags=re.IGNORECASE).strip()
+        return cleaned_track_name.split('/')[0].strip()
+
+    @staticmethod
+    def cache_key(cleaned_track_name, artist_name, duration_ms):
+        duration_s = int(duration_ms or 0) // 1000
+        return f"{cleaned_track_name.casefold()}|{artist_name.casefold()}|{duration_s}"
+
+    def get_cached_lyrics(self, track_name, artist_name, duration_ms, track_id=None):
+        """Consulta apenas o armazém e a cache: devolve (encontrado, letras), sem tocar na rede."""
+        if track_id:
+            found, lyrics = self.store.get(track_id)
+            if found: return True, lyrics
+        key = self.cache_key(self.clean_track_name(track_name), artist_name, duration_ms)
+        found, cached = self.cache.lookup(key)
+        if not found: return False, None
+        return True, LyricsTimeline.from_dict(cached) if cached else None
+
+    def get_synced_lyrics(self, track_name, artist_name, duration_ms, cancel_event=None, album_name=None, track_id=None,
+                          to_store=False):
+        """Letras da faixa: armazém por ID do Spotify, cache por nome/artista/duração e, por fim, a corrida entre fontes.
+
+        As letras encontradas vão para a cache SQLite (limitada e com TTL). Só o pré-carregamento
+        (to_store=True, com track_id) as grava no LyricsStore, que não tem despejo nem expiração.
+        Os resultados negativos vão sempre para a cache.
+        """
+        if to_store and track_id:
+            found, lyrics = self.store.get(track_id)
+            if found: return lyrics
+            # Encontradas na cache durante a reprodução: o pré-carregamento passa-as para o armazém.
+            found, lyrics = self.get_cached_lyrics(track_name, artist_name, duration_ms)
+            if found:
+                if lyrics: self.store.put(track_id, lyrics)
+                return lyrics
+        else:
+            found, lyrics = self.get_cached_lyrics(track_name, artist_name, duration_ms, track_id)
+            if found: return lyrics
+
+        cleaned_track_name = self.clean_track_name(track_name)
+        key = self.cache_key(cleaned_track_name, artist_name, duration_ms)
+        lyrics, network_error = self._race_providers(TrackQuery(cleaned_track_name, artist_name, duration_ms, album_name, track_name),
+                                                     cancel_event)
+
+        if lyrics:
+            self.remember_lyrics(track_name, artist_name, duration_ms, lyrics, track_id if to_store else None)
+        elif not network_error:
+            # Falhas de rede não são resultados negativos: só se guarda "sem letras" quando todas as fontes responderam.
+            self.cache.put(key, None, ttl=self.NEGATIVE_CACHE_TTL)
+        return lyrics
+
+    def remember_lyrics(self, track_name, artist_name, duration_ms, lyrics, track_id=None):
+        """Guarda letras obtidas noutro lado (por ex. no daemon) onde get_cached_lyrics as encontra:
+        com track_id no LyricsStore, senão na cache."""
+        if track_id:
+            self.store.put(track_id, lyrics)
+        else:
+            key = self.cache_key(self.clean_track_name(track_name), artist_name, duration_ms)
+            self.cache.put(key, lyrics.to_dict(), ttl=self.CACHE_TTL)
+
+    def _race_providers(self, query, outer_cancel_event=None):
+        """Consulta todas as fontes em simultâneo e devolve (letras, houve_falha_de_rede).
+
+        Ganha o primeiro resultado válido, a menos que uma fonte de maior prioridade ainda em
+        curso responda dentro de RANK_GRACE. As restantes são canceladas, tal como a corrida
+        inteira se outer_cancel_event for ativado (por exemplo, ao saltar de faixa).
+        """
+        cancel_event = threading.Event()
+        fetch = self._instrumented_fetch if METRICS.enabled else (lambda provider, *args: provider.fetch(*args))
+        try:
+            futures = {self._executor.submit(fetch, provider, query, cancel_event): provider for provider in self.providers}
+        except RuntimeError:  # close() já foi chamado
+            cancel_event.set()
+            return None, True
+        pending = set(futures)
+        best, best_provider, network_error = None, None, False
+        deadline = time.monotonic() + self.RACE_TIMEOUT
+        try:
+            while pending:
+                timeout = deadline - time.monotonic()
+                if best is not None:
+                    timeout = min(timeout, grace_deadline - time.monotonic())
+                if timeout <= 0 or self._closed.is_set(): break
+                if outer_cancel_event is not None and outer_cancel_event.is_set(): break
+                timeout = min(timeout, self.CANCEL_CHECK_INTERVAL)
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    provider = futures[future]
+                    try:
+                        lyrics = future.result()
+                    except requests.RequestException:
+                        network_error = True
+                        continue
+                    except Exception as e:
+                        print(f"Erro na fonte de letras {provider.name}: {e}")
+                        continue
+                    if lyrics and (best is None or provider.priority < best_provider.priority):
+                        if best is None:
+                            grace_deadline = time.monotonic() + self.RANK_GRACE
+                        best, best_provider = lyrics, provider
+                if best is not None and not any(futures[f].priority < best_provider.priority for f in pending):
+                    break
+        finally:
+            cancel_event.set()
+            for future in pending:
+                future.cancel()
+        if best is None and pending:
+            network_error = True  # fontes sem resposta a tempo: não é um resultado negativo
+        METRICS.log_event("lyrics_race", track=query.track_name, artist=query.artist_name,
+                          winner=best_provider.name if best_provider else None, network_error=network_error)
+        return best, network_error
+
+    def close(self):
+        """Termina as corridas em curso e encerra o executor das fontes sem esperar pelos pedidos já em voo."""
+        self._closed.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _instrumented_fetch(provider, query, cancel_event):
+        """provider.fetch com latência e resultado (hit/miss/error/cancelled) registados por fonte."""
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            lyrics = provider.fetch(query, cancel_event)
+            outcome = "hit" if lyrics else ("cancelled" if cancel_event.is_set() else "miss")
+            return lyrics
+        except RequestCancelled:
+            outcome = "cancelled"
+            raise
+        finally:
+            METRICS.observe("lyrics_provider_latency_seconds", time.perf_counter() - started, provider=provider.name)
+            METRICS.inc("lyrics_provider_requests_total", provider=provider.name, result=outcome)
+
+# --- Temas a partir da capa e pré-carregamento da fila ---
+
+def album_art_url(track):
+    """URL da imagem mais pequena da capa (suficiente para extrair a cor), ou None."""
+    album = track.get('album') or {}
+    images = album.get('images')
+    return images[-1]['url'] if images else None
+
+def album_theme_key(track):
+    """Chave da cache de temas: o ID do álbum (partilhado por todas as faixas), ou o URL da capa."""
+    album = track.get('album') or {}
+    return album.get('id') or album_art_url(track)
+
+class AlbumArtThemer:
+    """Calcula o tema (cor de fundo, cor do texto) a partir da cor dominante da capa do álbum.
+
+    A imagem é descodificada já reduzida (modo draft do JPEG) e a paleta obtida por k-means
+    vetorizado em NumPy, ou pela quantização do PIL se o NumPy não estiver instalado.
+    Os temas ficam em cache em memória e em disco, por álbum.
+    """
+    DEFAULT_THEME = ("#222222", "#FFFFFF")
+    THUMBNAIL_SIZE = (32, 32)
+    PALETTE_SIZE = 5
+    KMEANS_ITERATIONS = 8
+    CACHE_TTL = 365 * 86400
+
+    def __init__(self, session, cache=None):
+        self.http = session
+        self.cache = cache if cache is not None else PersistentLRUCache('theme_cache.sqlite3', max_bytes=2 * 1024 * 1024, default_ttl=self.CACHE_TTL)
+        self._memory = {}
+        self._lock = threading.Lock()
+
+    def cached_theme(self, key):
+        with self._lock:
+            theme = self._memory.get(key)
+        if theme: return theme
+        found, theme = self.cache.lookup(key)
+        if not found or not theme: return None
+        theme = tuple(theme)
+        with self._lock:
+            self._memory[key] = theme
+        return theme
+
+    def get_theme(self, url, key=None):
+        key = key or url
+        theme = self.cached_theme(key)
+        if theme: return theme
+
+        from PIL import Image
+        with self.http.get(url, stream=True) as response:
+            response.raise_for_status()
+            img = Image.open(response.raw)
+            img.draft('RGB', self.THUMBNAIL_SIZE)  # JPEG: descodifica logo a 1/2, 1/4 ou 1/8 da resolução
+            img = img.convert("RGB")
+        img.thumbnail(self.THUMBNAIL_SIZE, Image.Resampling.NEAREST)
+
+        theme = self._theme_from_color(*self._dominant_color(img))
+        self.remember_theme(key, theme)
+        return theme
+
+    def remember_theme(self, key, theme):
+        with self._lock:
+            self._memory[key] = theme
+        self.cache.put(key, list(theme))
+
+    def _dominant_color(self, img):
+        np = _optional_numpy()
+        if np is None:
+            return self._dominant_color_pil(img)
+        pixels = np.asarray(img, dtype=np.float32).reshape(-1, 3)
+        k = min(self.PALETTE_SIZE, len(pixels))
+        luma = pixels @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+        centers = pixels[np.argsort(luma)[np.linspace(0, len(pixels) - 1, k).astype(int)]]
+        for _ in range(self.KMEANS_ITERATIONS):
+            labels = ((pixels[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+            counts = np.bincount(labels, minlength=k)
+            sums = np.stack([np.bincount(labels, weights=pixels[:, c], minlength=k) for c in range(3)], axis=1)
+            new_centers = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centers)
+            if np.allclose(new_centers, centers, atol=0.5):
+                break
+            centers = new_centers
+        return self._pick_swatch(centers.round().astype(int).tolist(), counts.tolist())
+
+    def _dominant_color_pil(self, img):
+        from PIL import Image
+        quantized = img.quantize(colors=self.PALETTE_SIZE, method=Image.Quantize.MEDIANCUT)
+        palette = quantized.getpalette()
+        colors = quantized.getcolors()
+        return self._pick_swatch([palette[i * 3:i * 3 + 3] for _, i in colors], [count for count, _ in colors])
+
+    @staticmethod
+    def _pick_swatch(colors, counts):
+        """Escolhe a cor mais representativa, favorecendo tons saturados em vez de cinzentos dominantes."""
+        def score(item):
+            (r, g, b), count = item
+            high, low = max(r, g, b), min(r, g, b)
+            saturation = (high - low) / high if high else 0
+            return count * (0.35 + saturation)
+        return max(zip(colors, counts), key=score)[0]
+
+    @staticmethod
+    def _theme_from_color(r, g, b):
+        luminance = (0.299 * r + 0.587 * g + 0.114 * b) / 255
+        bg_color_obj = QColor(r, g, b)
+
+        if luminance > 0.55:
+            bg_color_obj = bg_color_obj.darker(160)
+        else:
+            bg_color_obj = bg_color_obj.lighter(130)
+
+        return (bg_color_obj.name(), "#FFFFFF")
+
+class QueuePrefetcher:
+    """Resolve em segundo plano as letras e o tema das próximas faixas da fila de reprodução."""
+    DEPTH = 3
+
+    def __init__(self, spotify, lyrics_fetcher, themer, tasks, depth=DEPTH):
+        self.spotify = spotify
+        self.lyrics_fetcher = lyrics_fetcher
+        self.themer = themer
+        self.tasks = tasks
+        self.depth = depth
+        self._lock = threading.Lock()
+        self._running = False
+
+    def prefetch_async(self):
+        with self._lock:
+            if self._running: return
+            self._running = True
+        self.tasks.submit(self._prefetch, scoped=False)
+
+    def _prefetch(self):
+        try:
+            for track in self.spotify.get_queue()[:self.depth]:
+                if track.get('type', 'track') != 'track' or not track.get('artists'):
+                    continue  # episódios de podcast não têm letras
+                self.lyrics_fetcher.get_synced_lyrics(track['name'], track['artists'][0]['name'], track['duration_ms'],
+                                                      album_name=(track.get('album') or {}).get('name'), track_id=track.get('id'))
+                url = album_art_url(track)
+                if url:
+                    try:
+                        self.themer.get_theme(url, album_theme_key(track))
+                    except Exception:
+                        pass
+        except Exception as e:
+            print(f"Erro no pré-carregamento da fila: {e}")
+        finally:
+            with self._lock:
+                self._running = False
+
+# --- Daemon partilhado (opcional) ---
+
+class DaemonUnavailable(ConnectionError):
+    """O daemon não está a correr, a ligação caiu ou não respondeu a tempo: usa-se a resolução local."""
+
+def default_daemon_address():
+    """Socket no diretório de runtime do utilizador (XDG_RUNTIME_DIR, ou um diretório 0700 próprio no tmp);
+    127.0.0.1:47615 onde não há sockets Unix."""
+    if not hasattr(socket, 'AF_UNIX'):
+        return ('127.0.0.1', 47615)
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if not runtime_dir or not os.path.isdir(runtime_dir):
+        runtime_dir = os.path.join(tempfile.gettempdir(), f"spotify-lyrics-overlay-{os.getuid()}")
+    return os.path.join(runtime_dir, 'spotify-lyrics-overlay.sock')
+
+def daemon_address(value=None):
+    """Endereço do daemon: value ou LYRICS_OVERLAY_DAEMON (caminho de socket Unix ou host:porta).
+
+    O daemon é opcional e só é usado se configurado: devolve None sem valor (ou com "off");
+    "on" escolhe default_daemon_address().
+    """
+    if value is None:
+        value = os.environ.get("LYRICS_OVERLAY_DAEMON", "")
+    if not value or value.lower() in ("off", "0", "no"): return None
+    if value.lower() in ("on", "1", "yes"):
+        return default_daemon_address()
+    if not value.startswith(('/', '.')) and ':' in value:
+        host, _, port = value.rpartition(':')
+        return (host, int(port))
+    return value
+
+def _check_socket_directory(path):
+    """Recusa sockets em diretórios onde qualquer utilizador pode escrever (como o /tmp): outro
+    utilizador poderia pôr lá o seu próprio socket e receber as faixas ou servir letras falsas."""
+    directory = os.path.dirname(os.path.abspath(path))
+    info = os.stat(directory)
+    if info.st_mode & stat.S_IWOTH:
+        raise PermissionError(f"{directory} pode ser escrito por qualquer utilizador; use um diretório próprio ou de um grupo")
+    if path == default_daemon_address() and info.st_uid != os.getuid():
+        raise PermissionError(f"{directory} não pertence a este utilizador")
+
+class _DaemonRequestHandler(socketserver.StreamRequestHandler):
+    """Uma ligação de cliente: pedidos e respostas em NDJSON, respondidos fora de ordem à medida que ficam prontos."""
+
+    def setup(self):
+        super().setup()
+        self.write_lock = threading.Lock()
+        self.server.daemon.connections.add(self)
+
+    def finish(self):
+        self.server.daemon.connections.discard(self)
+        super().finish()
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                continue
+            self.server.daemon.dispatch(self, request)
+
+    def send(self, message):
+        payload = json.dumps(message, ensure_ascii=False, separators=(',', ':')).encode() + b'\n'
+        try:
+            with self.write_lock:
+                self.wfile.write(payload)
+                self.wfile.flush()
+        except (OSError, ValueError):
+            pass  # o cliente desligou-se entretanto
+
+if hasattr(socketserver, 'ThreadingUnixStreamServer'):
+    class _DaemonUnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+class _DaemonTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class LyricsDaemon:
+    """Serviço local que resolve letras e temas para vários overlays (por ex. vários utilizadores na mesma máquina).
+
+    É dono do LyricsFetcher (fontes, cache e armazém) e do AlbumArtThemer. Pedidos iguais em
+    curso, vindos de qualquer cliente, partilham uma única resolução: cada cliente fica subscrito
+    ao resultado e recebe-o assim que existir.
+    """
+    ART_HOST_SUFFIXES = ('.scdn.co', '.spotifycdn.com')  # o daemon só descarrega capas do CDN do Spotify
+
+    def __init__(self, address, lyrics_fetcher=None, themer=None, workers=8):
+        self.address = address
+        self.http = HttpSession(pool_maxsize=max(10, workers))
+        self.lyrics_fetcher = lyrics_fetcher if lyrics_fetcher is not None else LyricsFetcher(session=self.http)
+        self.themer = themer if themer is not None else AlbumArtThemer(self.http)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lyrics-daemon")
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.connections = set()
+        if isinstance(address, tuple):
+            self.server = _DaemonTCPServer(address, _DaemonRequestHandler)
+        else:
+            if address == default_daemon_address():
+                os.makedirs(os.path.dirname(address), mode=0o700, exist_ok=True)
+            _check_socket_directory(address)
+            self._remove_stale_socket()
+            self.server = _DaemonUnixServer(address, _DaemonRequestHandler)
+            # Acessível ao grupo: para vários utilizadores, o diretório pertence a um grupo comum (setgid).
+            os.chmod(address, 0o660)
+        self.server.daemon = self
+
+    def _remove_stale_socket(self):
+        """Apaga o socket de uma execução anterior; qualquer outro ficheiro nesse caminho fica intacto."""
+        try:
+            mode = os.lstat(self.address).st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise FileExistsError(f"{self.address} existe e não é um socket")
+        os.remove(self.address)
+
+    def serve_forever(self):
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            for connection in list(self.connections):
+                try:
+                    connection.request.shutdown(socket.SHUT_RDWR)  # os clientes passam ao recurso local
+                except OSError:
+                    pass
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self.lyrics_fetcher.close()
+            self.http.close()
+            if not isinstance(self.address, tuple):
+                try:
+                    self._remove_stale_socket()
+                except OSError:
+                    pass
+
+    def shutdown(self):
+        self.server.shutdown()
+
+    def dispatch(self, connection, request):
+        if not isinstance(request, dict):
+            connection.send({'error': "pedido inválido"})
+            return
+        request_id = request.get('id')
+        params = request.get('params') or {}
+        if not isinstance(params, dict):
+            connection.send({'id': request_id, 'error': "pedido inválido"})
+            return
+        try:
+            key, work = self._resolve(request.get('op'), params)
+            hash(key)  # track_id ou key vindos do cliente podem ser listas ou objetos
+        except (KeyError, TypeError, ValueError) as e:
+            connection.send({'id': request_id, 'error': f"pedido inválido: {e}"})
+            return
+        with self._lock:
+            future = self._inflight.get(key)
+            started = future is None
+            if started:
+                try:
+                    future = self._executor.submit(work)
+                except RuntimeError:  # a encerrar
+                    connection.send({'id': request_id, 'error': "daemon a encerrar"})
+                    return
+                self._inflight[key] = future
+        if started:
+            # Fora do lock: se o trabalho já terminou, o callback corre já nesta thread.
+            future.add_done_callback(lambda _f: self._forget(key, future))
+        METRICS.inc("daemon_requests_total", op=key[0], shared=not started)
+        future.add_done_callback(lambda f: self._reply(connection, request_id, f))
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                self._inflight.pop(key)
+
+    @staticmethod
+    def _reply(connection, request_id, future):
+        try:
+            connection.send({'id': request_id, 'result': future.result()})
+        except Exception as e:
+            connection.send({'id': request_id, 'error': str(e)})
+
+    def _resolve(self, op, params):
+        """Chave de deduplicação e trabalho a executar para um pedido."""
+        if op == 'ping':
+            return ('ping', None), lambda: 'pong'
+        if op == 'lyrics':
+            args = (params['track_name'], params['artist_name'], params.get('duration_ms'))
+            album_name, track_id = params.get('album_name'), params.get('track_id')
+            key = ('lyrics', track_id or LyricsFetcher.cache_key(LyricsFetcher.clean_track_name(args[0]), args[1], args[2]))
+
+            def work():
+                lyrics = self.lyrics_fetcher.get_synced_lyrics(*args, album_name=album_name, track_id=track_id)
+                return lyrics.to_dict() if lyrics else None
+            return key, work
+        if op == 'theme':
+            url = params['url']
+            parts = urllib.parse.urlsplit(url)
+            if parts.scheme != 'https' or not (parts.hostname or '').endswith(self.ART_HOST_SUFFIXES):
+                raise ValueError(f"URL de capa não permitido: {url}")
+            theme_key = params.get('key') or url
+            return ('theme', theme_key), lambda: list(self.themer.get_theme(url, theme_key))
+        raise ValueError(f"operação desconhecida: {op}")
+
+class DaemonClient:
+    """Ligação ao LyricsDaemon. Qualquer falha levanta DaemonUnavailable; depois de uma falha de
+    ligação só se volta a tentar passados RECONNECT_INTERVAL segundos, para o recurso local ser imediato."""
+    CONNECT_TIMEOUT = 0.5
+    REQUEST_TIMEOUT = 15
+    RECONNECT_INTERVAL = 30
+
+    def __init__(self, address):
+        self.address = address
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._sock = None
+        self._pending = {}
+        self._ids = itertools.count(1)
+        self._retry_at = 0.0
+
+    @classmethod
+    def from_env(cls):
+        address = daemon_address()
+        return cls(address) if address else None
+
+    def _connection(self):
+        with self._lock:
+            if self._sock is not None: return self._sock
+            if time.monotonic() < self._retry_at:
+                raise DaemonUnavailable("daemon indisponível")
+            family = socket.AF_INET if isinstance(self.address, tuple) else socket.AF_UNIX
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.settimeout(self.CONNECT_TIMEOUT)
+            try:
+                if family == socket.AF_UNIX:
+                    _check_socket_directory(self.address)
+                sock.connect(self.address)
+            except OSError as e:
+                sock.close()
+                self._retry_at = time.monotonic() + self.RECONNECT_INTERVAL
+                raise DaemonUnavailable(str(e)) from e
+            sock.settimeout(None)
+            self._sock = sock
+            threading.Thread(target=self._read_responses, args=(sock,), daemon=True).start()
+            return sock
+
+    def _read_responses(self, sock):
+        try:
+            with sock.makefile('rb') as stream:
+                for line in stream:
+                    message = json.loads(line)
+                    future = self._pending.pop(message.get('id'), None)
+                    if future is not None and not future.done():
+                        future.set_result(message)
+        except (OSError, ValueError):
+            pass
+        self._disconnect(sock)
+
+    def _disconnect(self, sock):
+        with self._lock:
+            if self._sock is sock:
+                self._sock = None
+                self._retry_at = time.monotonic() + self.RECONNECT_INTERVAL
+        try:
+            sock.close()
+        except OSError:
+            pass
+        for request_id in list(self._pending):
+            future = self._pending.pop(request_id, None)
+            if future is not None and not future.done():
+                future.set_exception(DaemonUnavailable("ligação ao daemon perdida"))
+
+    def call(self, op, cancel_event=None, **params):
+        """Envia um pedido e espera pela resposta. Devolve None se cancel_event for ativado entretanto."""
+        sock = self._connection()
+        request_id = next(self._ids)
+        future = Future()
+        self._pending[request_id] = future
+        payload = json.dumps({'id': request_id, 'op': op, 'params': params}, ensure_ascii=False).encode() + b'\n'
+        try:
+            with self._send_lock:
+                sock.sendall(payload)
+        except OSError as e:
+            self._disconnect(sock)
+            raise DaemonUnavailable(str(e)) from e
+        deadline = time.monotonic() + self.REQUEST_TIMEOUT
+        try:
+            while True:
+                try:
+                    message = future.result(timeout=0.25 if cancel_event is not None else max(0.0, deadline - time.monotonic()))
+                    break
+                except FutureTimeoutError:
+                    if cancel_event is not None and cancel_event.is_set(): return None
+                    if time.monotonic() >= deadline:
+                        raise DaemonUnavailable("o daemon não respondeu a tempo")
+        finally:
+            self._pending.pop(request_id, None)
+        if 'error' in message:
+            raise DaemonUnavailable(message['error'])
+        return message.get('result')
+
+    def close(self):
+        with self._lock:
+            sock, self._sock = self._sock, None
+            self._retry_at = float('inf')
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+class RemoteLyricsFetcher:
+    """Cliente fino do LyricsFetcher: as resoluções vão ao daemon e, se ele não estiver disponível,
+    ao LyricsFetcher local. Consultas à cache e o resto da interface ficam no local."""
+
+    def __init__(self, client, local):
+        self.client = client
+        self.local = local
+
+    def __getattr__(self, name):
+        return getattr(self.local, name)
+
+    def get_synced_lyrics(self, track_name, artist_name, duration_ms, cancel_event=None, album_name=None, track_id=None,
+                          to_store=False):
+        """Letras encontradas pelo daemon ficam também na cache local, para get_cached_lyrics (troca de faixa,
+        fila pré-carregada) as ver sem perguntar. "Sem letras" não: do lado do cliente não se distingue de uma falha de rede do daemon."""
+        try:
+            data = self.client.call('lyrics', cancel_event, track_name=track_name, artist_name=artist_name,
+                                    duration_ms=duration_ms, album_name=album_name, track_id=track_id)
+            if not data: return None
+            lyrics = LyricsTimeline.from_dict(data)
+            if len(lyrics.times) != len(lyrics.texts) or not all(isinstance(text, str) for text in lyrics.texts):
+                raise ValueError("linha temporal inválida")
+        except DaemonUnavailable:
+            return self.local.get_synced_lyrics(track_name, artist_name, duration_ms, cancel_event, album_name, track_id, to_store)
+        except (KeyError, TypeError, ValueError, OverflowError) as e:
+            print(f"Aviso: resposta inválida do daemon ({e}); a procurar localmente.")
+            return self.local.get_synced_lyrics(track_name, artist_name, duration_ms, cancel_event, album_name, track_id, to_store)
+        self.local.remember_lyrics(track_name, artist_name, duration_ms, lyrics, track_id if to_store else None)
+        return lyrics
+
+class RemoteThemer:
+    """Cliente fino do AlbumArtThemer, com o mesmo recurso local que RemoteLyricsFetcher."""
+
+    def __init__(self, client, local):
+        self.client = client
+        self.local = local
+
+    def __getattr__(self, name):
+        return getattr(self.local, name)
+
+    _COLOR = re.compile(r'#[0-9a-fA-F]{6}')
+
+    def get_theme(self, url, key=None):
+        theme = self.local.cached_theme(key or url)
+        if theme: return theme
+        try:
+            theme = tuple(self.client.call('theme', url=url, key=key))
+            if len(theme) != 2 or not all(isinstance(color, str) and self._COLOR.fullmatch(color) for color in theme):
+                raise ValueError(f"tema inválido: {theme!r}")
+        except DaemonUnavailable:
+            return self.local.get_theme(url, key)
+        except (TypeError, ValueError) as e:
+            print(f"Aviso: resposta inválida do daemon ({e}); a calcular o tema localmente.")
+            return self.local.get_theme(url, key)
+        self.local.remember_theme(key or url, theme)
+        return theme
+
+def daemon_main(args):
+    address = daemon_address(args.address) or default_daemon_address()
+    try:
+        DaemonClient(address).call('ping')
+    except DaemonUnavailable:
+        pass
+    else:
+        print(f"ERRO: já existe um daemon à escuta em {address}")
+        return 1
+    try:
+        daemon = LyricsDaemon(address, workers=args.workers)
+    except OSError as e:
+        print(f"ERRO: não foi possível abrir o daemon em {address}: {e}")
+        return 1
+    local_provider = LocalLrcProvider.from_env()
+    if local_provider:
+        daemon.lyrics_fetcher.add_provider(local_provider)
+    print(f"Daemon de letras à escuta em {address}")
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
 
 # --- Nova Classe de Interface Gráfica com PySide6 ---
 
+class RoundedFrame(QFrame):
+    """Fundo da janela com cantos arredondados, pintado diretamente em vez de via stylesheet."""
+    RADIUS = 12
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._color = QColor("#222222")
+
+    def set_color(self, color):
+        if color == self._color: return
+        self._color = QColor(color)
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(self._color)
+        painter.drawRoundedRect(self.rect(), self.RADIUS, self.RADIUS)
+
+class ShadowTextView(QWidget):
+    """Linhas de texto centradas com sombra, desenhadas em paintEvent a partir de pixmaps em cache.
+
+    Substitui QLabel + QGraphicsDropShadowEffect, que obriga o Qt a renderizar cada label fora do
+    ecrã e a compô-la de novo a cada repaint. Cada linha é rasterizada (texto e sombra) uma vez
+    por texto/fonte/cor; uma mudança de texto faz um cross-fade entre o pixmap antigo e o novo.
+    """
+    SHADOW_OFFSET = 1
+    FADE_MS = 180
+    CACHE_SIZE = 64
+
+    def __init__(self, rows=1, spacing=5, shadow_color=QColor(0, 0, 0, 120), parent=None):
+        super().__init__(parent)
+        self.shadow_color = QColor(shadow_color)
+        self._spacing = spacing
+        self._lines = [None] * rows     # chave (texto, fonte, cor) aplicada em cada linha
+        self._pixmaps = [None] * rows   # pixmap atual de cada linha
+        self._fading_out = [None] * rows
+        self._fade = 1.0
+        self._cache = OrderedDict()
+        self._fade_animation = QVariantAnimation(self)
+        self._fade_animation.setStartValue(0.0)
+        self._fade_animation.setEndValue(1.0)
+        self._fade_animation.setDuration(self.FADE_MS)
+        self._fade_animation.valueChanged.connect(self._on_fade)
+        self._fade_animation.finished.connect(self._end_fade)
+
+    def sizeHint(self):
+        """Como a QLabel: a altura chega para o texto mostrado (e a sua sombra)."""
+        heights = sum(pixmap.deviceIndependentSize().height() for pixmap in self._pixmaps if pixmap is not None)
+        return QSize(0, math.ceil(heights) + self._spacing * (len(self._pixmaps) - 1))
+
+    def minimumSizeHint(self):
+        return self.sizeHint()
+
+    def set_text(self, text, font, color):
+        """Vistas de uma só linha (estado, pausa): muda sem cross-fade."""
+        self.set_line(0, text, font, color, fade=False)
+
+    def set_line(self, row, text, font, color, fade=True):
+        color = QColor(color)
+        key = (text, font.key(), color.rgba())
+        if self._lines[row] == key: return
+        self._lines[row] = key
+        previous = self._pixmaps[row]
+        self._pixmaps[row] = self._pixmap_for(text, font, color) if text else None
+        if self._height_of(previous) != self._height_of(self._pixmaps[row]):
+            self.updateGeometry()
+        if fade and previous is not None and self.isVisible():
+            self._fading_out[row] = previous
+            self._fade = 0.0
+            self._fade_animation.stop()
+            self._fade_animation.start()
+        else:
+            self._fading_out[row] = None
+        self.update()
+
+    @staticmethod
+    def _height_of(pixmap):
+        return pixmap.deviceIndependentSize().height() if pixmap is not None else 0
+
+    def _pixmap_for(self, text, font, color):
+        dpr = self.devicePixelRatioF()
+        key = (text, font.key(), color.rgba(), self.shadow_color.rgba(), dpr)
+        pixmap = self._cache.get(key)
+        if pixmap is not None:
+            self._cache.move_to_end(key)
+            return pixmap
+        metrics = QFontMetrics(font)
+        width = metrics.horizontalAdvance(text) + self.SHADOW_OFFSET + 2
+        height = metrics.height() + self.SHADOW_OFFSET
+        pixmap = QPixmap(max(1, math.ceil(width * dpr)), max(1, math.ceil(height * dpr)))
+        pixmap.setDevicePixelRatio(dpr)
+        pixmap.fill(Qt.transparent)
+        painter = QPainter(pixmap)
+        painter.setRenderHint(QPainter.TextAntialiasing)
+        painter.setFont(font)
+        painter.setPen(self.shadow_color)
+        painter.drawText(1 + self.SHADOW_OFFSET, metrics.ascent() + self.SHADOW_OFFSET, text)
+        painter.setPen(color)
+        painter.drawText(1, metrics.ascent(), text)
+        painter.end()
+        self._cache[key] = pixmap
+        if len(self._cache) > self.CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return pixmap
+
+    def _on_fade(self, value):
+        self._fade = value
+        self.update()
+
+    def _end_fade(self):
+        self._fade = 1.0
+        self._fading_out = [None] * len(self._fading_out)
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        rows = len(self._pixmaps)
+        row_height = (self.height() - self._spacing * (rows - 1)) / rows
+        for row in range(rows):
+            top = row * (row_height + self._spacing)
+            fading_out = self._fading_out[row]
+            for pixmap, opacity in ((fading_out, 1.0 - self._fade),
+                                    (self._pixmaps[row], self._fade if fading_out is not None else 1.0)):
+                if pixmap is None or opacity <= 0: continue
+                size = pixmap.deviceIndependentSize()
+                painter.setOpacity(opacity)
+                painter.drawPixmap(QPointF((self.width() - size.width()) / 2, top + (row_height - size.height()) / 2), pixmap)
+
 class LyricsUI(QWidget):
     """Gerencia a janela de sobreposição com PySide6 para um design moderno."""
+    SHADOW_COLOR = QColor(0, 0, 0, 120)
+    PROGRESS_MIN_INTERVAL_MS = 250  # a barra avança no máximo 4x/s; o relógio só ao mudar o segundo
+    visibility_changed = Signal(bool)
+    FRAME_SHADOW_SPREAD = 10  # equivalente a um desfoque de 20 px
+    FRAME_SHADOW_OFFSET = 5
+    PAUSE_TEXT = "❚❚"
 
     def __init__(self, app_instance):
         super().__init__()
@@ -200,12 +2356,27 @@ class LyricsUI(QWidget):
         self.BG_COLOR = "#222222"
         self.last_bg_color = self.BG_COLOR
         self.fg_color = "#FFFFFF" # Cor do texto principal
+        self._applied_fg_color = None
+        self._font_cache = {}
+        self._shown_lines = ["", ""]  # linha atual e seguinte, para reaplicar quando a cor muda
+        self._status_text = ""
+        self._frame_shadow = None  # (tamanho, pixmap) da sombra da moldura
 
         self._setup_window()
         self._setup_ui()
 
-        self.progress_animation = QPropertyAnimation(self.progress_bar, b"value", self)
-        self.progress_animation.valueChanged.connect(self._update_time_label_from_animation)
+        # Em vez de uma animação a cada frame, um temporizador grosseiro acorda só quando o segundo
+        # mostrado ou o pixel da barra mudam; parado em pausa, sem reprodução ou com a janela escondida.
+        self.progress_timer = QTimer(self)
+        self.progress_timer.setSingleShot(True)
+        self.progress_timer.setTimerType(Qt.CoarseTimer)
+        self.progress_timer.timeout.connect(self._tick_progress)
+        self._progress_anchor = None  # (posição ms, instante monotónico) enquanto toca
+        self.position_source = None   # callable com a posição atual (o PlaybackClock); sem ele, extrapola
+        self._progress_position = 0
+        self._progress_duration = 0
+        self._shown_progress = None   # (segundo, pixel) mostrados
+        self._shown_duration = None
 
         self.bg_animation = QPropertyAnimation(self, b"bgColor", self)
         self.bg_animation.setDuration(800)
@@ -227,39 +2398,25 @@ class LyricsUI(QWidget):
         self.main_layout = QVBoxLayout(self)
         self.main_layout.setContentsMargins(15, 15, 15, 15)
 
-        self.background_frame = QFrame(self)
+        self.background_frame = RoundedFrame(self)
         self.background_frame.setObjectName("backgroundFrame")
         self.main_layout.addWidget(self.background_frame)
 
-        self.shadow = QGraphicsDropShadowEffect(self)
-        self.shadow.setBlurRadius(20)
-        self.shadow.setOffset(0, 5)
-        self.background_frame.setGraphicsEffect(self.shadow)
-
         frame_layout = QVBoxLayout(self.background_frame)
         frame_layout.setContentsMargins(20, 10, 20, 10)
 
         self.view_stack = QStackedWidget(self)
 
-        # Vista 1: Letras
-        self.lyrics_widget = QWidget()
-        lyrics_layout = QVBoxLayout(self.lyrics_widget)
-        lyrics_layout.setContentsMargins(0, 0, 0, 0)
-        lyrics_layout.setSpacing(5)
-        self.current_line_label = self._create_shadowed_label()
-        self.next_line_label = self._create_shadowed_label()
-        lyrics_layout.addWidget(self.current_line_label)
-        lyrics_layout.addWidget(self.next_line_label)
+        # Vista 1: Letras (linha atual e seguinte)
+        self.lyrics_widget = ShadowTextView(rows=2, spacing=5, shadow_color=self.SHADOW_COLOR)
         self.view_stack.addWidget(self.lyrics_widget)
 
         # Vista 2: Pausa
-        self.pause_label = self._create_shadowed_label()
-        self.pause_label.setText("❚❚")
-        self.pause_label.setObjectName("pauseLabel")
+        self.pause_label = ShadowTextView(shadow_color=self.SHADOW_COLOR)
         self.view_stack.addWidget(self.pause_label)
 
         # Vista 3: Estado
-        self.status_label = self._create_shadowed_label()
+        self.status_label = ShadowTextView(shadow_color=self.SHADOW_COLOR)
         self.view_stack.addWidget(self.status_label)
 
         self.progress_widget = QWidget()
@@ -280,69 +2437,56 @@ class LyricsUI(QWidget):
         frame_layout.addWidget(self.view_stack, 1)
         frame_layout.addWidget(self.progress_widget)
 
-    def _create_shadowed_label(self):
-        label = QLabel("", self)
-        label.setAlignment(Qt.AlignCenter)
-        shadow = QGraphicsDropShadowEffect(self)
-        shadow.setBlurRadius(0)
-        shadow.setOffset(1, 1)
-        label.setGraphicsEffect(shadow)
-        return label
-
     def set_theme_colors(self, bg_hex, fg_hex):
         self.fg_color = fg_hex
+        if fg_hex != self._applied_fg_color:
+            self._apply_foreground(fg_hex)
+        self.start_bg_animation(bg_hex)
 
-        secondary_color = QColor(self.fg_color)
-        secondary_color.setAlpha(180)
+    def _apply_foreground(self, fg_hex):
+        """Reaplica estilos e paletas dependentes da cor do texto; só corre quando essa cor muda."""
+        self._applied_fg_color = fg_hex
 
-        shadow_color = QColor("#000000")
-        shadow_color.setAlpha(120)
+        secondary_color = QColor(fg_hex)
+        secondary_color.setAlpha(180)
 
-        progress_bg_color = QColor(shadow_color)
+        progress_bg_color = QColor(self.SHADOW_COLOR)
         progress_bg_color.setAlpha(50)
 
-        self.shadow.setColor(shadow_color)
-        self.current_line_label.graphicsEffect().setColor(shadow_color)
-        self.next_line_label.graphicsEffect().setColor(shadow_color)
-        self.status_label.graphicsEffect().setColor(shadow_color)
-        self.pause_label.graphicsEffect().setColor(shadow_color)
-
         secondary_color_rgba = f"rgba({secondary_color.red()}, {secondary_color.green()}, {secondary_color.blue()}, {secondary_color.alphaF()})"
         progress_bg_color_rgba = f"rgba({progress_bg_color.red()}, {progress_bg_color.green()}, {progress_bg_color.blue()}, {progress_bg_color.alphaF()})"
 
         stylesheet = f"""
-            #timeLabel, #statusLabel {{
+            #timeLabel {{
                 color: {secondary_color_rgba};
                 font-size: 10px;
             }}
-            #pauseLabel {{
-                color: {self.fg_color};
-                font-size: 40px;
-                font-weight: bold;
-                letter-spacing: -10px;
-            }}
             QProgressBar {{
                 background-color: {progress_bg_color_rgba};
                 border: none;
                 border-radius: 2px;
             }}
             QProgressBar::chunk {{
-                background-color: {self.fg_color};
+                background-color: {fg_hex};
                 border-radius: 2px;
             }}
         """
         self.progress_widget.setStyleSheet(stylesheet)
-        self.status_label.setStyleSheet(stylesheet)
-        self.pause_label.setStyleSheet(stylesheet)
 
-        self.start_bg_animation(bg_hex)
+        self._line_colors = (QColor(fg_hex), secondary_color)
+        self.set_lyric_lines(*self._shown_lines)
+        self._set_status_text(self._status_text)
+        pause_font = QFont(self._font_for(40, True))
+        pause_font.setLetterSpacing(QFont.AbsoluteSpacing, -10)
+        self.pause_label.set_text(self.PAUSE_TEXT, pause_font, QColor(fg_hex))
 
     def update_display(self, current_lyric, next_lyric, progress_ms, duration_ms, is_playing, status_mode=False):
         if status_mode:
             self.progress_widget.hide()
-            self.status_label.setText(current_lyric)
+            self._set_status_text(current_lyric)
             self.view_stack.setCurrentWidget(self.status_label)
-            self.progress_animation.stop()
+            self._progress_anchor = None
+            self.progress_timer.stop()
         else:
             self.progress_widget.show()
 
@@ -351,27 +2495,79 @@ class LyricsUI(QWidget):
             else:
                 self.view_stack.setCurrentWidget(self.pause_label)
 
-            def get_font_size(text, is_active):
-                base_size = 22 if is_active else 18
-                if len(text) > 85: return base_size - 9
-                if len(text) > 65: return base_size - 5
-                if len(text) > 50: return base_size - 2
-                return base_size
-
-            secondary_color = QColor(self.fg_color)
-            secondary_color.setAlpha(180)
-            secondary_color_rgba = f"rgba({secondary_color.red()}, {secondary_color.green()}, {secondary_color.blue()}, {secondary_color.alphaF()})"
-
-            self.current_line_label.setText(current_lyric)
-            self.current_line_label.setStyleSheet(f"background-color: transparent; font-size: {get_font_size(current_lyric, True)}px; font-weight: bold; color: {self.fg_color};")
-
-            self.next_line_label.setText(next_lyric)
-            self.next_line_label.setStyleSheet(f"background-color: transparent; font-size: {get_font_size(next_lyric, False)}px; color: {secondary_color_rgba};")
-
-            self._update_progress(progress_ms, duration_ms, is_playing)
+            with METRICS.timer("ui_update_seconds", part="display"):
+                self.set_lyric_lines(current_lyric, next_lyric)
+                self._update_progress(progress_ms, duration_ms, is_playing)
+
+    def set_lyric_lines(self, current_lyric, next_lyric):
+        with METRICS.timer("ui_update_seconds", part="lyrics"):
+            self._set_line(0, current_lyric, True)
+            self._set_line(1, next_lyric, False)
+
+    @staticmethod
+    def _font_size_for(text, is_active):
+        base_size = 22 if is_active else 18
+        if len(text) > 85: return base_size - 9
+        if len(text) > 65: return base_size - 5
+        if len(text) > 50: return base_size - 2
+        return base_size
+
+    def _font_for(self, size, bold):
+        font = self._font_cache.get((size, bold))
+        if font is None:
+            font = QFont(self.font())
+            font.setPixelSize(size)
+            font.setBold(bold)
+            self._font_cache[(size, bold)] = font
+        return font
+
+    def _set_line(self, row, text, is_active):
+        """O ShadowTextView ignora linhas iguais às já mostradas; só uma mudança gera um pixmap novo."""
+        self._shown_lines[row] = text
+        font = self._font_for(self._font_size_for(text, is_active), is_active)
+        self.lyrics_widget.set_line(row, text, font, self._line_colors[row])
+
+    def _set_status_text(self, text):
+        self._status_text = text
+        self.status_label.set_text(text, self._font_for(10, False), self._line_colors[1])
+
+    def paintEvent(self, event):
+        """Sombra da moldura a partir de um pixmap em cache (em vez de um QGraphicsDropShadowEffect)."""
+        frame = self.background_frame.geometry()
+        spread = self.FRAME_SHADOW_SPREAD
+        painter = QPainter(self)
+        painter.drawPixmap(frame.x() - spread, frame.y() - spread + self.FRAME_SHADOW_OFFSET, self._frame_shadow_for(frame.size()))
+
+    def _frame_shadow_for(self, size):
+        """Aproxima o desfoque com retângulos arredondados concêntricos e translúcidos; refeito só se a moldura mudar de tamanho."""
+        if self._frame_shadow is not None and self._frame_shadow[0] == size:
+            return self._frame_shadow[1]
+        spread = self.FRAME_SHADOW_SPREAD
+        pixmap = QPixmap(size.width() + 2 * spread, size.height() + 2 * spread)
+        pixmap.fill(Qt.transparent)
+        color = QColor(self.SHADOW_COLOR)
+        # Camadas com a mesma opacidade; sobrepostas, chegam a metade da de SHADOW_COLOR junto à moldura,
+        # como o desfoque gaussiano que substituem.
+        color.setAlphaF(1 - (1 - self.SHADOW_COLOR.alphaF() / 2) ** (1 / spread))
+        painter = QPainter(pixmap)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(color)
+        for inset in range(spread):
+            radius = RoundedFrame.RADIUS + spread - inset
+            painter.drawRoundedRect(QRect(inset, inset, pixmap.width() - 2 * inset, pixmap.height() - 2 * inset), radius, radius)
+        painter.end()
+        self._frame_shadow = (QSize(size), pixmap)
+        return pixmap
 
     def start_bg_animation(self, new_color_hex):
+        if new_color_hex == self.last_bg_color and self.bg_animation.state() != QPropertyAnimation.Running:
+            return
         self.bg_animation.stop()
+        if not self.isVisible():
+            self.bgColor = QColor(new_color_hex)  # escondida, não há transição para ver
+            self.last_bg_color = new_color_hex
+            return
         self.bg_animation.setStartValue(QColor(self.last_bg_color))
         self.bg_animation.setEndValue(QColor(new_color_hex))
         self.bg_animation.start()
@@ -384,7 +2580,7 @@ class LyricsUI(QWidget):
     @bgColor.setter
     def bgColor(self, color):
         self.BG_COLOR = color.name()
-        self.background_frame.setStyleSheet(f"#backgroundFrame {{ background-color: {self.BG_COLOR}; border-radius: 12px; }}")
+        self.background_frame.set_color(color)
 
     def _format_time(self, ms):
         if ms is None: return "0:00"
@@ -392,25 +2588,59 @@ class LyricsUI(QWidget):
         minutes = int((ms / (1000 * 60)) % 60)
         return f"{minutes}:{seconds:02d}"
 
-    def _update_time_label_from_animation(self, value):
-        self.current_time_label.setText(self._format_time(value))
-
     def _update_progress(self, progress_ms, duration_ms, is_playing):
-        self.progress_animation.stop()
-
-        self.total_time_label.setText(self._format_time(duration_ms))
-        self.progress_bar.setRange(0, duration_ms if duration_ms > 0 else 100)
-
-        if is_playing and duration_ms > 0 and progress_ms is not None:
-            remaining_time = duration_ms - progress_ms
-            if remaining_time > 0:
-                self.progress_animation.setDuration(remaining_time)
-                self.progress_animation.setStartValue(progress_ms)
-                self.progress_animation.setEndValue(duration_ms)
-                self.progress_animation.start()
-        else:
-            self.progress_bar.setValue(progress_ms if progress_ms is not None else 0)
-            self.current_time_label.setText(self._format_time(progress_ms))
+        if duration_ms != self._shown_duration:
+            self._shown_duration = duration_ms
+            self.total_time_label.setText(self._format_time(duration_ms))
+            self.progress_bar.setRange(0, duration_ms if duration_ms > 0 else 100)
+            self._shown_progress = None
+
+        self._progress_position = progress_ms if progress_ms is not None else 0
+        self._progress_duration = duration_ms
+        playing = is_playing and duration_ms > 0 and progress_ms is not None
+        self._progress_anchor = (self._progress_position, time.monotonic()) if playing else None
+        self._tick_progress()
+
+    def _tick_progress(self):
+        """Aplica a posição extrapolada, só se o segundo ou o pixel mudaram, e marca o próximo acordar."""
+        position, duration = self._progress_position, self._progress_duration
+        if self._progress_anchor is not None and self.position_source is not None:
+            # Segue o relógio suavizado: as correções de sincronização não fazem a barra saltar.
+            position = min(self.position_source(), duration)
+        elif self._progress_anchor is not None:
+            anchor_ms, anchor_time = self._progress_anchor
+            position = min(anchor_ms + (time.monotonic() - anchor_time) * 1000, duration)
+        width = max(1, self.progress_bar.width())
+        ms_per_pixel = duration / width if duration > 0 else 0
+        pixel = int(position // ms_per_pixel) if ms_per_pixel else 0
+        second = int(position // 1000)
+
+        shown_second, shown_pixel = self._shown_progress or (None, None)
+        if second != shown_second:
+            self.current_time_label.setText(self._format_time(position))
+        if pixel != shown_pixel:
+            self.progress_bar.setValue(int(position))
+        self._shown_progress = (second, pixel)
+
+        if self._progress_anchor is None or position >= duration or not self.isVisible():
+            self.progress_timer.stop()
+            return
+        until_second = 1000 - position % 1000
+        until_pixel = (pixel + 1) * ms_per_pixel - position
+        self.progress_timer.start(max(1, math.ceil(min(until_second, max(until_pixel, self.PROGRESS_MIN_INTERVAL_MS)))))
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self._tick_progress()
+        self.visibility_changed.emit(True)
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.progress_timer.stop()
+        if self.bg_animation.state() == QPropertyAnimation.Running:
+            self.bg_animation.stop()
+            self.bgColor = QColor(self.last_bg_color)
+        self.visibility_changed.emit(False)
 
     def mousePressEvent(self, event):
         self.drag_pos = event.globalPosition().toPoint()
@@ -422,70 +2652,199 @@ class LyricsUI(QWidget):
 
 # --- Comunicação entre Threads ---
 class WorkerSignals(QObject):
-    update = Signal(dict)
-    no_playback = Signal()
     theme_update = Signal(str, str) # bg_color, fg_color
+    toggle_visibility = Signal()
+    adjust_lyrics_offset = Signal(int)  # ms; 0 repõe
     shutdown_signal = Signal()
 
+class TaskRunner(QObject):
+    """Núcleo de trabalho em segundo plano: executores limitados, integrados com o ciclo de eventos do Qt.
+
+    As tarefas "por faixa" pertencem à geração atual; new_generation() cancela as que ainda
+    estão em fila, ativa o cancel_event das que já correm e descarta os seus resultados.
+    Os callbacks on_result correm sempre na thread do Qt.
+    """
+    LANES = {"default": 4, "poll": 1}  # o poll tem a sua própria via para nunca esperar por downloads
+
+    _finished = Signal(object, object, object) # callback, resultado, geração
+
+    def __init__(self, lanes=None):
+        super().__init__()
+        self._executors = {name: ThreadPoolExecutor(max_workers=size, thread_name_prefix=f"overlay-{name}")
+                           for name, size in (lanes or self.LANES).items()}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._cancel_event = threading.Event()
+        self._scoped_futures = set()
+        self._closed = False
+        self._finished.connect(self._deliver)
+
+    @property
+    def cancel_event(self):
+        """Evento ativado quando a geração atual for substituída."""
+        return self._cancel_event
+
+    def new_generation(self):
+        with self._lock:
+            self._generation += 1
+            self._cancel_event.set()
+            self._cancel_event = threading.Event()
+            stale, self._scoped_futures = self._scoped_futures, set()
+        for future in stale:
+            future.cancel()
+
+    def submit(self, fn, *args, on_result=None, scoped=True, lane="default"):
+        with self._lock:
+            if self._closed: return None
+            generation = self._generation if scoped else None
+            future = self._executors[lane].submit(self._run, fn, args, on_result, generation)
+            if scoped:
+                self._scoped_futures.add(future)
+        if scoped:
+            future.add_done_callback(self._forget)
+        return future
+
+    def _forget(self, future):
+        with self._lock:
+            self._scoped_futures.discard(future)
+
+    def _run(self, fn, args, on_result, generation):
+        try:
+            result = fn(*args)
+        except Exception as e:
+            print(f"Erro numa tarefa em segundo plano ({getattr(fn, '__name__', fn)}): {e}")
+            return
+        if on_result is not None and not self._closed and (generation is None or generation == self._generation):
+            self._finished.emit(on_result, result, generation)
+
+    def _deliver(self, callback, result, generation):
+        if self._closed or (generation is not None and generation != self._generation): return
+        callback(result)
+
+    def run_detached(self, fn, *args, on_result=None):
+        """Corre fn numa thread daemon própria, fora dos executores: para trabalho que pode bloquear sem
+        limite (input() da consola) e que não deve atrasar a saída. on_result corre na thread do Qt."""
+        threading.Thread(target=self._run, args=(fn, args, on_result, None), daemon=True).start()
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            self._cancel_event.set()
+        for executor in self._executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+
 # --- Classe Principal do Aplicativo ---
 
 class SpotifyLyricsOverlay:
+    NOT_FOUND_TEXT = "Letras não encontradas."
+
     def __init__(self, app):
         self.app = app
-        self.spotify = SpotifyAPI()
-        self.lyrics_fetcher = LyricsFetcher()
+        self.http = HttpSession()
+        self.tasks = TaskRunner()
+        self.spotify = SpotifyAPI(session=self.http)
+        self.lyrics_fetcher = LyricsFetcher(session=self.http)
+        local_provider = LocalLrcProvider.from_env()
+        if local_provider:
+            self.lyrics_fetcher.add_provider(local_provider)
+        self.themer = AlbumArtThemer(self.http)
+        self.daemon = DaemonClient.from_env()
+        if self.daemon:
+            # Com o daemon partilhado a correr, letras e temas são resolvidos lá; sem ele, aqui.
+            self.lyrics_fetcher = RemoteLyricsFetcher(self.daemon, self.lyrics_fetcher)
+            self.themer = RemoteThemer(self.daemon, self.themer)
+        self.prefetcher = QueuePrefetcher(self.spotify, self.lyrics_fetcher, self.themer, self.tasks)
         self.ui = LyricsUI(self)
         self.tray_icon = None
+        self.metrics_server = None
 
         self.running = True
-        self.stop_event = threading.Event()
         self.current_track_id = None
         self.synced_lyrics = None
+        self.displayed_lines = None
         self.no_playback_counter = 0
+        self.clock = PlaybackClock()
+        self.poll_scheduler = PollScheduler()
+        self.lyrics_offsets = LyricsOffsets()
+        self.lyrics_offset_ms = 0
+        self.ui.position_source = self.clock.position
+
+        self.poll_timer = QTimer()
+        self.poll_timer.setSingleShot(True)
+        self.poll_timer.timeout.connect(self.poll_playback)
+
+        # Entre consultas, a linha muda exatamente no instante seguinte da letra, extrapolado pelo relógio local.
+        self.lyrics_timer = QTimer()
+        self.lyrics_timer.setSingleShot(True)
+        self.lyrics_timer.setTimerType(Qt.PreciseTimer)
+        self.lyrics_timer.timeout.connect(self._on_line_due)
 
         self.signals = WorkerSignals()
-        self.signals.update.connect(self.process_playback_data)
-        self.signals.no_playback.connect(self.handle_no_playback)
         self.signals.theme_update.connect(self.ui.set_theme_colors)
+        self.signals.toggle_visibility.connect(self.toggle_window_visibility)
+        self.signals.adjust_lyrics_offset.connect(self.adjust_lyrics_offset)
+        self.ui.visibility_changed.connect(self._on_visibility_changed)
         self.signals.shutdown_signal.connect(self.shutdown)
 
 
     def run(self):
-        if not self.spotify.load_saved_token():
+        # Com um token guardado, a janela aparece logo e a validação/renovação corre em segundo plano.
+        has_saved_token = self.spotify.read_saved_token()
+        if not has_saved_token:
             if not self.authenticate_spotify():
                 return
 
         self.ui.show()
         self.ui.update_display("A aguardar música no Spotify...", "", 0, 0, False, status_mode=True)
 
+        metrics_port = os.environ.get("LYRICS_OVERLAY_METRICS_PORT")
+        if METRICS.enabled and metrics_port:
+            try:
+                self.metrics_server = MetricsServer(METRICS, int(metrics_port))
+                self.metrics_server.start()
+            except (OSError, ValueError) as e:
+                print(f"Aviso: endpoint de métricas indisponível: {e}")
+
         threading.Thread(target=self.setup_tray_icon, daemon=True).start()
 
-        self.start_monitoring_thread()
+        if has_saved_token:
+            self.tasks.submit(self.spotify.validate_token, on_result=self._on_token_validated, scoped=False)
+        else:
+            self.start_monitoring()
+
+    def _on_token_validated(self, valid):
+        if not self.running: return
+        if not valid:
+            self.ui.update_display("Sessão do Spotify inválida: autentique-se na consola.", "", 0, 0, False, status_mode=True)
+            # input() bloquearia o ciclo de eventos (janela e "Sair" do tray): a consola é atendida numa thread
+            # daemon, que não impede a saída enquanto espera pelo utilizador.
+            self.tasks.run_detached(self.authenticate_spotify, on_result=self._on_console_authenticated)
+            return
+        self.start_monitoring()
+
+    def _on_console_authenticated(self, authenticated):
+        if not self.running: return
+        if not authenticated:
+            self.request_shutdown()
+            return
+        self.ui.update_display("A aguardar música no Spotify...", "", 0, 0, False, status_mode=True)
+        self.start_monitoring()
 
     def authenticate_spotify(self):
-        auth_url = self.spotify.get_auth_url()
-        print(f"\n1. Copie esta URL: {auth_url}\n2. Cole no navegador, autorize e cole o URL de redirecionamento aqui.")
-        webbrowser.open(auth_url)
-        while True:
-            try:
-                redirected_url = input("🔗 Cole o URL de redirecionamento aqui: ")
-                parsed_url = urllib.parse.urlparse(redirected_url)
-                query_params = urllib.parse.parse_qs(parsed_url.query)
-                if 'code' in query_params:
-                    if self.spotify.exchange_code_for_token(query_params['code'][0]):
-                        return True
-                else:
-                    print("❌ URL inválido.")
-            except Exception:
-                print("❌ Erro na autenticação. A encerrar.")
-                return False
+        return self.spotify.authenticate_console()
 
     def setup_tray_icon(self):
+        from PIL import Image, ImageDraw
+        import pystray
         width, height, color1, color2 = 64, 64, (29, 185, 84), (19, 19, 19)
         image = Image.new('RGB', (width, height), color2)
         dc = ImageDraw.Draw(image)
         dc.ellipse([(10, 10), (width - 10, height - 10)], fill=color1)
-        menu = (pystray.MenuItem('Mostrar/Esconder', self.toggle_window_visibility, default=True),
+        step = LyricsOffsets.STEP_MS
+        menu = (pystray.MenuItem('Mostrar/Esconder', lambda: self.signals.toggle_visibility.emit(), default=True),
+                pystray.MenuItem(f'Atrasar letras ({step} ms)', lambda: self.signals.adjust_lyrics_offset.emit(step)),
+                pystray.MenuItem(f'Adiantar letras ({step} ms)', lambda: self.signals.adjust_lyrics_offset.emit(-step)),
+                pystray.MenuItem('Repor sincronização das letras', lambda: self.signals.adjust_lyrics_offset.emit(0)),
                 pystray.MenuItem('Sair', self.request_shutdown))
         self.tray_icon = pystray.Icon("name", image, "Spotify Lyrics Overlay", menu)
         self.tray_icon.run()
@@ -496,29 +2855,67 @@ class SpotifyLyricsOverlay:
         else:
             self.ui.show()
 
-    def start_monitoring_thread(self):
-        threading.Thread(target=self.monitor_loop, daemon=True).start()
+    def adjust_lyrics_offset(self, delta_ms):
+        """Desvio manual da faixa atual, lembrado para a próxima vez que tocar."""
+        if self.current_track_id is None: return
+        self.lyrics_offset_ms = self.lyrics_offsets.adjust(self.current_track_id, delta_ms)
+        print(f"Desvio das letras nesta faixa: {self.lyrics_offset_ms:+d} ms")
+        self.refresh_lyrics_line()
+        self._schedule_next_line()
+
+    def _lyrics_position(self):
+        return self.clock.position() - self.lyrics_offset_ms
+
+    def _on_visibility_changed(self, visible):
+        """Escondida, a janela não acorda para mudar linhas e as consultas espaçam; ao mostrar, ressincroniza já."""
+        if visible:
+            self.refresh_lyrics_line()
+            self._schedule_next_line()
+            if self.poll_timer.isActive():
+                self.poll_timer.start(0)
+        else:
+            self.lyrics_timer.stop()
 
-    def monitor_loop(self):
-        while self.running:
-            try:
-                playback_data = self.spotify.get_current_playback()
-                if not self.running:
-                    break
+    def start_monitoring(self):
+        self.poll_timer.start(0)
 
-                if playback_data and playback_data.get('item'):
-                    self.no_playback_counter = 0
-                    self.signals.update.emit(playback_data)
-                else:
-                    self.no_playback_counter += 1
-                    if self.no_playback_counter >= 2:
-                        self.signals.no_playback.emit()
+    def poll_playback(self):
+        if self.running:
+            self.tasks.submit(self._fetch_playback, on_result=self._on_playback_polled, scoped=False, lane="poll")
 
-            except Exception as e:
-                print(f"ERRO no monitor_loop: {e}")
+    def _fetch_playback(self):
+        """Corre no executor: consulta o Spotify e sincroniza o relógio assim que a resposta chega."""
+        has_playback, discontinuity, playback_data = False, False, None
+        try:
+            playback_data = self.spotify.get_current_playback()
+            if playback_data and playback_data.get('item'):
+                has_playback = True
+                track = playback_data['item']
+                # O 'timestamp' da resposta marca a última mudança de estado, não o instante da amostra:
+                # a latência vem do RTT medido.
+                discontinuity = self.clock.update(track['id'], playback_data.get('progress_ms', 0), track['duration_ms'],
+                                                  playback_data.get('is_playing', False), rtt=self.spotify.last_poll_rtt)
+        except Exception as e:
+            print(f"ERRO na consulta ao Spotify: {e}")
+        return playback_data, has_playback, discontinuity
 
-            if self.stop_event.wait(1):
-                break
+    def _on_playback_polled(self, result):
+        if not self.running: return
+        playback_data, has_playback, discontinuity = result
+        try:
+            if has_playback:
+                self.no_playback_counter = 0
+                self.process_playback_data(playback_data)
+            elif self.spotify.retry_after() == 0:
+                self.no_playback_counter += 1
+                if self.no_playback_counter >= 2:
+                    self.handle_no_playback()
+        except Exception as e:
+            print(f"ERRO ao processar a reprodução: {e}")
+
+        delay = self.poll_scheduler.next_delay(self.clock, has_playback, discontinuity, self.spotify.retry_after(),
+                                               hidden=not self.ui.isVisible())
+        self.poll_timer.start(int(delay * 1000))
 
     def process_playback_data(self, data):
         track = data.get('item')
@@ -526,76 +2923,81 @@ class SpotifyLyricsOverlay:
 
         track_id = track['id']
         is_playing = data.get('is_playing', False)
-        progress_ms = data.get('progress_ms', 0)
         duration_ms = track['duration_ms']
+        position_ms = self.clock.position()
 
-        album_art_url = track['album']['images'][-1]['url'] if track.get('album') and track['album'].get('images') else None
+        art_url = album_art_url(track)
+        theme_key = album_theme_key(track)
 
         if track_id != self.current_track_id:
             self.current_track_id = track_id
+            self.lyrics_offset_ms = self.lyrics_offsets.get(track_id)
             self.synced_lyrics = None
-            self.ui.update_display("A procurar letras...", "", progress_ms, duration_ms, is_playing, status_mode=True)
-            self.signals.theme_update.emit("#222222", "#FFFFFF")
-            threading.Thread(target=self.fetch_and_set_lyrics, args=(track_id, track['name'], track['artists'][0]['name'], duration_ms, album_art_url), daemon=True).start()
-
-        current_line_text, next_line_text = "", ""
-        if self.synced_lyrics:
-            last_line_index = -1
-            animated_progress = self.ui.progress_bar.value()
-            for i, line in enumerate(self.synced_lyrics):
-                if animated_progress >= line['time']:
-                    last_line_index = i
-                else:
-                    break
-
-            if last_line_index != -1:
-                current_line_text = self.synced_lyrics[last_line_index]['text']
-                if last_line_index + 1 < len(self.synced_lyrics):
-                    next_line_text = self.synced_lyrics[last_line_index + 1]['text']
-                else:
-                    next_line_text = ""
-            else:
-                current_line_text = ""
-                if self.synced_lyrics:
-                    next_line_text = self.synced_lyrics[0]['text']
-
-        self.ui.update_display(current_line_text, next_line_text, progress_ms, duration_ms, is_playing)
-
-    def fetch_and_set_lyrics(self, track_id, track_name, artist_name, duration_ms, album_art_url):
-        lyrics = self.lyrics_fetcher.get_synced_lyrics(track_name, artist_name, duration_ms)
-        if self.current_track_id == track_id:
-            self.synced_lyrics = lyrics if lyrics else [{'time': 0, 'text': "Letras não encontradas."}]
-            if album_art_url:
-                threading.Thread(target=self.set_background_from_url, args=(album_art_url,), daemon=True).start()
-
-    def set_background_from_url(self, url):
-        try:
-            response = requests.get(url, stream=True)
-            response.raise_for_status()
-            img = Image.open(response.raw).convert("RGB").resize((1, 1), Image.Resampling.LANCZOS)
-            r, g, b = img.getpixel((0, 0))
-
-            luminance = (0.299 * r + 0.587 * g + 0.114 * b) / 255
-            bg_color_obj = QColor(r, g, b)
-
-            if luminance > 0.55:
-                bg_color_obj = bg_color_obj.darker(160)
+            self.tasks.new_generation()
+            artist_name = track['artists'][0]['name']
+            METRICS.log_event("track_change", track_id=track_id, track=track['name'], artist=artist_name)
+            theme = self.themer.cached_theme(theme_key) if theme_key else None
+            self.signals.theme_update.emit(*(theme or AlbumArtThemer.DEFAULT_THEME))
+            if art_url and not theme:
+                self.tasks.submit(self.themer.get_theme, art_url, theme_key, on_result=self._on_theme_ready)
+
+            found, lyrics = self.lyrics_fetcher.get_cached_lyrics(track['name'], artist_name, duration_ms, track_id)
+            if found:
+                self.synced_lyrics = lyrics if lyrics else LyricsTimeline([0], [self.NOT_FOUND_TEXT])
             else:
-                bg_color_obj = bg_color_obj.lighter(130)
-
-            fg_color_hex = "#FFFFFF"
-
-            self.signals.theme_update.emit(bg_color_obj.name(), fg_color_hex)
-        except Exception as e:
-            print(f"Erro ao processar cor da capa: {e}")
-            self.signals.theme_update.emit("#222222", "#FFFFFF")
+                self.ui.update_display("A procurar letras...", "", position_ms, duration_ms, is_playing, status_mode=True)
+                self.tasks.submit(self.lyrics_fetcher.get_synced_lyrics, track['name'], artist_name, duration_ms, self.tasks.cancel_event,
+                                  (track.get('album') or {}).get('name'), track_id, on_result=self._on_lyrics_fetched)
+            self.prefetcher.prefetch_async()
+
+        self.displayed_lines = self.synced_lyrics.lines_at(position_ms - self.lyrics_offset_ms) if self.synced_lyrics else ("", "")
+        self.ui.update_display(*self.displayed_lines, position_ms, duration_ms, is_playing)
+        self._schedule_next_line()
+
+    def refresh_lyrics_line(self):
+        if not self.synced_lyrics: return
+        lines = self.synced_lyrics.lines_at(self._lyrics_position())
+        if lines != self.displayed_lines:
+            self.displayed_lines = lines
+            self.ui.set_lyric_lines(*lines)
+
+    def _on_lyrics_fetched(self, lyrics):
+        # só chega aqui se a faixa ainda for a atual (a geração do TaskRunner não mudou)
+        self.synced_lyrics = lyrics if lyrics else LyricsTimeline([0], [self.NOT_FOUND_TEXT])
+        self.refresh_lyrics_line()
+        self._schedule_next_line()
+
+    def _on_theme_ready(self, theme):
+        self.ui.set_theme_colors(*(theme or AlbumArtThemer.DEFAULT_THEME))
+
+    def _on_line_due(self):
+        self.refresh_lyrics_line()
+        self._schedule_next_line()
+
+    def _schedule_next_line(self):
+        """(Re)arma o temporizador para a próxima linha; chamado a cada sincronização (seek, pausa, nova consulta)."""
+        if not (self.clock.is_playing and self.synced_lyrics and self.ui.isVisible()):
+            self.lyrics_timer.stop()
+            return
+        position_ms = self._lyrics_position()
+        next_ms = self.synced_lyrics.next_change_ms(position_ms)
+        if next_ms is None:
+            self.lyrics_timer.stop()
+        else:
+            # O relógio pode avançar mais depressa ou mais devagar que o tempo real enquanto absorve uma correção.
+            wait_ms = self.clock.ms_until(next_ms + self.lyrics_offset_ms)
+            self.lyrics_timer.start(max(1, math.ceil(next_ms - position_ms if wait_ms is None else wait_ms)))
 
     def handle_no_playback(self):
         if self.current_track_id is not None:
             self.current_track_id = None
+            self.lyrics_offset_ms = 0
             self.synced_lyrics = None
+            self.tasks.new_generation()
+            self.clock.reset()
+            self.lyrics_timer.stop()
             self.ui.update_display("Nenhuma música a tocar...", "", 0, 0, False, status_mode=True)
-            self.signals.theme_update.emit("#222222", "#FFFFFF")
+            self.signals.theme_update.emit(*AlbumArtThemer.DEFAULT_THEME)
             self.no_playback_counter = 0
 
     def request_shutdown(self):
@@ -605,12 +3007,180 @@ class SpotifyLyricsOverlay:
 
     def shutdown(self):
         self.running = False
-        self.stop_event.set()
+        self.poll_timer.stop()
+        self.lyrics_timer.stop()
+        self.tasks.shutdown()
+        self.lyrics_fetcher.close()
+        self.spotify.close()
+        if self.daemon:
+            self.daemon.close()
+        if self.metrics_server:
+            self.metrics_server.stop()
+        self.http.close()
         self.app.quit()
 
 
+# --- Pré-carregamento em massa (linha de comandos) ---
+
+def parse_playlist_id(value):
+    """Aceita o ID, o URI spotify:playlist:... ou o URL open.spotify.com/playlist/... de uma playlist."""
+    value = value.strip()
+    if value.startswith('spotify:playlist:'):
+        return value.rsplit(':', 1)[1]
+    path = urllib.parse.urlsplit(value).path
+    if '/playlist/' in path:
+        return path.rstrip('/').rsplit('/', 1)[1]
+    return value
+
+class LyricsPrewarmer:
+    """Resolve as letras de muitas faixas de uma vez, fora da reprodução, com paralelismo limitado.
+
+    As faixas concluídas (com ou sem letras) são acrescentadas ao ficheiro de progresso, pelo que
+    uma execução interrompida retoma onde ficou; as que falharam por erro de rede voltam a ser
+    tentadas. Os limites por host ficam na HttpSession partilhada com as fontes.
+    """
+    DEFAULT_RATE_LIMITS = {"api.spotify.com": 10, "lrclib.net": 5, "www.megalobiz.com": 1}
+    REPORT_INTERVAL = 5.0
+
+    def __init__(self, lyrics_fetcher, workers=4, progress_path='prewarm_progress.txt'):
+        self.lyrics_fetcher = lyrics_fetcher
+        self.workers = workers
+        self.progress_path = progress_path
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+    def _load_progress(self):
+        try:
+            with open(self.progress_path, encoding='utf-8') as f:
+                return {line.strip() for line in f if line.strip()}
+        except FileNotFoundError:
+            return set()
+
+    def run(self, tracks):
+        """Consome o iterável de objetos track do Spotify (pode ser paginado e preguiçoso) e devolve as estatísticas."""
+        done = self._load_progress()
+        started = time.monotonic()
+        last_report = started
+        pending = set()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="prewarm") as executor, \
+                open(self.progress_path, 'a', encoding='utf-8') as progress:
+            try:
+                for track in tracks:
+                    if not track or track.get('type', 'track') != 'track' or not track.get('id') or not track.get('artists'):
+                        self.stats['skipped'] += 1
+                        continue
+                    if track['id'] in done:
+                        self.stats['resumed'] += 1
+                        continue
+                    done.add(track['id'])  # duplicados na mesma playlist só são pedidos uma vez
+                    if len(pending) >= 2 * self.workers:
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        self._record(finished, progress)
+                    pending.add(executor.submit(self._resolve, track))
+                    if time.monotonic() - last_report >= self.REPORT_INTERVAL:
+                        last_report = time.monotonic()
+                        self.print_report(last_report - started)
+                while pending:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self._record(finished, progress)
+            except KeyboardInterrupt:
+                print("\nInterrompido: a terminar as faixas em curso (o progresso fica guardado)...")
+                for future in pending:
+                    future.cancel()
+                self._record([f for f in pending if not f.cancelled()], progress)
+        self.stats['elapsed_s'] = time.monotonic() - started
+        return self.stats
+
+    def _resolve(self, track):
+        album_name = (track.get('album') or {}).get('name')
+        lyrics = self.lyrics_fetcher.get_synced_lyrics(track['name'], track['artists'][0]['name'], track['duration_ms'],
+                                                      album_name=album_name, track_id=track['id'], to_store=True)
+        if lyrics: return track['id'], 'found'
+        # Sem letras e sem resultado negativo em cache: houve falha de rede, tenta-se na próxima execução.
+        found, _ = self.lyrics_fetcher.get_cached_lyrics(track['name'], track['artists'][0]['name'], track['duration_ms'])
+        return track['id'], 'missing' if found else 'error'
+
+    def _record(self, futures, progress):
+        for future in futures:
+            try:
+                track_id, outcome = future.result()
+            except Exception as e:
+                print(f"Erro no pré-carregamento: {e}")
+                self.stats['error'] += 1
+                continue
+            self.stats[outcome] += 1
+            if outcome != 'error':
+                progress.write(track_id + '\n')
+        progress.flush()
+
+    def print_report(self, elapsed):
+        resolved = self.stats['found'] + self.stats['missing'] + self.stats['error']
+        rate = resolved / elapsed if elapsed > 0 else 0.0
+        print(f"[{elapsed:7.1f} s] {resolved} faixas ({rate:.2f}/s): {self.stats['found']} com letras, "
+              f"{self.stats['missing']} sem letras, {self.stats['error']} com erro, {self.stats['resumed']} já feitas")
+
+def prewarm_main(args):
+    http = HttpSession(pool_connections=10, pool_maxsize=max(10, args.workers * 3))
+    rate_limits = dict(LyricsPrewarmer.DEFAULT_RATE_LIMITS)
+    rate_limits.update(args.rate or ())
+    for host, per_second in rate_limits.items():
+        http.set_rate_limit(host, per_second)
+
+    spotify = SpotifyAPI(session=http)
+    if not (spotify.read_saved_token() and spotify.validate_token()):
+        if not spotify.authenticate_console():
+            return 1
+    fetcher = LyricsFetcher(session=http)
+    local_provider = LocalLrcProvider.from_env()
+    if local_provider:
+        fetcher.add_provider(local_provider)
+
+    tracks = spotify.iter_saved_tracks() if args.saved else spotify.iter_playlist_tracks(parse_playlist_id(args.playlist))
+    prewarmer = LyricsPrewarmer(fetcher, workers=args.workers, progress_path=args.progress)
+    try:
+        stats = prewarmer.run(tracks)
+    except (PermissionError, requests.RequestException) as e:
+        print(f"ERRO ao listar as faixas: {e}")
+        return 1
+    finally:
+        spotify.close()
+        http.close()
+    prewarmer.print_report(stats['elapsed_s'])
+    return 0 if stats['error'] == 0 else 2
+
+def _rate_limit_arg(spec):
+    host, _, value = spec.partition('=')
+    try:
+        return host, float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"esperado HOST=N, recebido {spec!r}")
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Overlay de letras sincronizadas para o Spotify.")
+    commands = parser.add_subparsers(dest='command')
+    prewarm = commands.add_parser('prewarm', help="pré-carrega as letras de uma playlist ou das faixas guardadas")
+    source = prewarm.add_mutually_exclusive_group(required=True)
+    source.add_argument('--playlist', help="ID, URI ou URL da playlist")
+    source.add_argument('--saved', action='store_true', help="faixas guardadas na biblioteca (\"Gostei\")")
+    prewarm.add_argument('--workers', type=int, default=4, help="faixas resolvidas em paralelo (omissão: 4)")
+    prewarm.add_argument('--rate', action='append', type=_rate_limit_arg, metavar='HOST=N',
+                         help="máximo de pedidos por segundo a um host (repetível; por ex. lrclib.net=5)")
+    prewarm.add_argument('--progress', default='prewarm_progress.txt', help="ficheiro de progresso para retomar")
+    daemon = commands.add_parser('daemon', help="serviço local partilhado de letras e temas para vários overlays")
+    daemon.add_argument('--address', help="socket Unix ou host:porta (omissão: LYRICS_OVERLAY_DAEMON ou o socket no diretório de runtime do utilizador)")
+    daemon.add_argument('--workers', type=int, default=8, help="resoluções em paralelo (omissão: 8)")
+    return parser
+
 if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
+    if args.command == 'prewarm':
+        sys.exit(prewarm_main(args))
+    if args.command == 'daemon':
+        sys.exit(daemon_main(args))
+
     print("A iniciar...")
+    if METRICS.enabled:
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
 
     app = QApplication(sys.argv)
     app.setQuitOnLastWindowClosed(False)